@@ -0,0 +1,117 @@
+import hashlib
+import hmac
+import threading
+from collections import namedtuple, OrderedDict
+from functools import wraps
+
+import bcrypt
+from flask import request, current_app
+from flask.ext.httpauth import HTTPBasicAuth
+from itsdangerous import URLSafeTimedSerializer, BadSignature, SignatureExpired
+
+# what handlers see as g.user once a request is authenticated
+Identity = namedtuple('Identity', 'id email')
+
+
+class HTTPTokenAuth(HTTPBasicAuth):
+    def __init__(self):
+        super(HTTPTokenAuth, self).__init__()
+        self.verify_token_callback = None
+
+    def verify_token(self, f):
+        self.verify_token_callback = f
+        return f
+
+    def login_required(self, f):
+        basic = super(HTTPTokenAuth, self).login_required(f)
+
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+            if scheme.lower() != 'bearer':
+                return basic(*args, **kwargs)
+            if not self.verify_token_callback(token.strip()):
+                return self.auth_error_callback()
+            return f(*args, **kwargs)
+        return decorated
+
+
+# bcrypt itself; module-level so a process pool can run them (app/passwords.py)
+
+def to_bytes(value):
+    return value.encode('utf-8') if isinstance(value, str) else value
+
+
+def hash_password(password, rounds):
+    pw_hash = bcrypt.hashpw(to_bytes(password), bcrypt.gensalt(rounds))
+    return pw_hash.decode('ascii') if isinstance(pw_hash, bytes) else pw_hash
+
+
+def check_password(password, pw_hash):
+    pw_hash = to_bytes(pw_hash)
+    try:
+        return hmac.compare_digest(to_bytes(bcrypt.hashpw(to_bytes(password), pw_hash)), pw_hash)
+    except ValueError:
+        return False
+
+
+def hash_cost(pw_hash):
+    # the log rounds of a '$2a$12$...' hash
+    try:
+        return int(to_bytes(pw_hash).split(b'$')[2])
+    except (IndexError, ValueError):
+        return None
+
+
+def token_serializer():
+    return URLSafeTimedSerializer(current_app.config['SECRET_KEY'], salt='auth-token')
+
+
+def generate_token(user):
+    return token_serializer().dumps([user.id, user.email])
+
+
+def load_token(token):
+    try:
+        id, email = token_serializer().loads(token, max_age=current_app.config['TOKEN_EXPIRATION'])
+    except (BadSignature, SignatureExpired, TypeError, ValueError):
+        return None
+    return Identity(id, email)
+
+
+class CredentialCache(object):
+    # Remembers HTTP Basic credentials that already passed bcrypt. Entries are
+    # tagged with the user table version, so a password change in any worker
+    # invalidates them.
+
+    def __init__(self, size):
+        self.size = size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def key(self, email, password):
+        secret = current_app.config['SECRET_KEY'].encode('utf-8')
+        message = ('%s\0%s' % (email, password)).encode('utf-8')
+        return hmac.new(secret, message, hashlib.sha256).digest()
+
+    def get(self, key, version):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] != version:
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, version, identity):
+        with self.lock:
+            self.entries[key] = (version, identity)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
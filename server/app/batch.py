@@ -0,0 +1,167 @@
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import request
+from flask.ext.restful import abort
+from werkzeug.test import EnvironBuilder
+from werkzeug.urls import url_parse
+
+from app.server import app, db
+from app.bulk import json_items, error_list
+
+# GET requests to the other resources, run in this process one after the
+# other with the batch's session and the request hooks skipped. They read
+# from one transaction, a snapshot on SQLite (WAL) and on PostgreSQL
+# (repeatable read), so the lists agree with each other. With ?parallel=1
+# they run on a thread pool instead, each with its own session and no shared
+# snapshot. The bodies are spliced into the response without decoding them.
+
+# (name, path) requested by GET /api/v1/bootstrap, the initial page load
+BOOTSTRAP = [
+    ('contacts', '/api/v1/contacts'),
+    ('projects', '/api/v1/projects'),
+    ('tags', '/api/v1/tags'),
+    ('milestones', '/api/v1/milestones'),
+    ('efforts', '/api/v1/efforts'),
+    ('columns', '/api/v1/columns'),
+    ('issues', '/api/v1/issues'),
+]
+
+# never finish, or are batches themselves
+UNBATCHED = ('/api/v1/projects/<int:id>/events', '/api/v1/batch', '/api/v1/bootstrap')
+
+# outer request headers every sub-request gets
+FORWARDED_HEADERS = ('Authorization',)
+
+# run first in the read transaction, by database
+SNAPSHOT_STATEMENTS = {
+    'sqlite': 'BEGIN',
+    'postgresql': 'SET TRANSACTION ISOLATION LEVEL REPEATABLE READ',
+}
+
+
+class SubRequestPool(object):
+    def __init__(self):
+        self.executor = None
+        self.pid = None
+        self.lock = threading.Lock()
+
+    def pool(self):
+        # started in the worker process that uses it, after any fork
+        with self.lock:
+            if self.pid != os.getpid():
+                self.executor, self.pid = ThreadPoolExecutor(app.config['BATCH_THREADS']), os.getpid()
+            return self.executor
+
+
+sub_request_pool = SubRequestPool()
+
+
+def item_errors(item):
+    if not isinstance(item, dict):
+        return {'item': ['Expected a JSON object']}
+    errors = {}
+    path = item.get('path')
+    if not isinstance(path, str) or not path.startswith('/'):
+        errors['path'] = ['Expected a path starting with /']
+    if item.get('method', 'GET') != 'GET':
+        errors['method'] = ['Only GET requests can be batched']
+    headers = item.get('headers', {})
+    if not isinstance(headers, dict) or not all(isinstance(value, str) for value in headers.values()):
+        errors['headers'] = ['Expected an object of strings']
+    return errors
+
+
+def sub_environ(path, headers=None):
+    url = url_parse(path)
+    forwarded = dict((name, request.headers[name]) for name in FORWARDED_HEADERS if name in request.headers)
+    forwarded.update(headers or {})
+    builder = EnvironBuilder(path=url.path, query_string=url.query, method='GET', base_url=request.host_url,
+                             headers=forwarded)
+    return builder.get_environ()
+
+
+def dispatch():
+    # the response of the request whose context is pushed, without the
+    # before and after request hooks
+    if request.routing_exception is not None:
+        # no resource, so not a flask-restful error
+        return request.routing_exception.code, None, json.dumps({'message': request.routing_exception.name})
+    if request.url_rule.rule in UNBATCHED:
+        return 400, None, json.dumps({'message': 'Cannot be batched'})
+    try:
+        rv = app.dispatch_request()
+    except Exception as e:
+        rv = app.handle_user_exception(e)
+    response = app.make_response(rv)
+    data = response.get_data()
+    if not data:
+        body = 'null'
+    elif response.mimetype == 'application/json':
+        body = data.decode('utf-8')
+    else:
+        body = json.dumps(data.decode('utf-8'))
+    return response.status_code, response.headers.get('ETag'), body
+
+
+def run_in_context(environ):
+    with app.request_context(environ):
+        return dispatch()
+
+
+def run_isolated(environ):
+    # on a pool thread: its own g, session and teardown
+    with app.app_context():
+        return run_in_context(environ)
+
+
+def begin_snapshot():
+    # sub-requests are reads, routed to the replica if there is one
+    engine = db.replica if db.replica is not None else db.engine
+    db.session.rollback()
+    statement = SNAPSHOT_STATEMENTS.get(engine.name)
+    if statement is not None:
+        db.session.execute(statement, bind=engine)
+
+
+def run_all(environs):
+    # (status, etag, body) of each environ, in order
+    if request.args.get('parallel') in ('1', 'true'):
+        return list(sub_request_pool.pool().map(run_isolated, environs))
+    begin_snapshot()
+    try:
+        return [run_in_context(environ) for environ in environs]
+    finally:
+        db.session.rollback()
+
+
+def encode_result(result):
+    status, etag, body = result
+    return '{"status": %d, "etag": %s, "body": %s}' % (status, json.dumps(etag), body)
+
+
+def json_response(body):
+    return app.response_class(body, mimetype='application/json')
+
+
+def batch():
+    items = json_items()
+    if len(items) > app.config['BATCH_MAX_REQUESTS']:
+        abort(400, message='At most %d requests per batch' % app.config['BATCH_MAX_REQUESTS'])
+    errors = {}
+    for index, item in enumerate(items):
+        found = item_errors(item)
+        if found:
+            errors[index] = found
+    if errors:
+        return error_list(errors), 422
+    results = run_all([sub_environ(item['path'], item.get('headers')) for item in items])
+    return json_response('[%s]' % ', '.join(encode_result(result) for result in results))
+
+
+def bootstrap():
+    results = run_all([sub_environ(path) for name, path in BOOTSTRAP])
+    return json_response('{%s}' % ', '.join('%s: %s' % (json.dumps(name), encode_result(result))
+                                            for (name, path), result in zip(BOOTSTRAP, results)))
@@ -0,0 +1,247 @@
+from flask import request, Response
+from flask.ext.restful import abort
+from sqlalchemy import bindparam
+from sqlalchemy.exc import IntegrityError
+
+from app.server import db
+from app.versions import touch
+from app.sync import bury
+from app.events import record_ids
+from app.validation import REQUIRED
+
+# stay below SQLite's default limit of 999 bound parameters per statement
+CHUNK_SIZE = 500
+
+
+def chunks(items, size=CHUNK_SIZE):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def is_bulk():
+    return isinstance(request.get_json(silent=True), list)
+
+
+def json_items():
+    items = request.get_json(silent=True)
+    if not isinstance(items, list):
+        abort(400, message='Expected a JSON array')
+    return items
+
+
+def id_list(value):
+    try:
+        return [int(id) for id in value.split(',') if id.strip()]
+    except ValueError:
+        abort(400, message='ids must be a comma separated list of integers')
+
+
+def referencing(model):
+    # (model, column) of the nullable foreign keys pointing at model's table
+    found = []
+    for child in db.Model.__subclasses__():
+        for column in child.__table__.columns:
+            if column.nullable and any(key.column.table is model.__table__ for key in column.foreign_keys):
+                found.append((child, column))
+    return found
+
+
+def detach(model, ids):
+    # Clears the foreign keys to rows about to be deleted, as the ORM's
+    # backrefs did on a delete, with the updates recorded like any other.
+    for child, column in referencing(model):
+        table = child.__table__
+        for chunk in chunks(ids):
+            affected = [id for (id,) in db.session.execute(db.select([table.c.id]).where(column.in_(chunk)))]
+            if not affected:
+                continue
+            db.session.execute(table.update().where(table.c.id.in_(affected)).values({column.key: None}))
+            touch(db.session, [table.name])
+            record_ids(db.session, child, 'updated', affected)
+
+
+def delete_where(model, *criterion):
+    query = model.query.filter(*criterion)
+    ids = [id for (id,) in query.with_entities(model.id)]
+    detach(model, ids)
+    bury(db.session, model.__tablename__, ids)
+    for chunk in chunks(ids):
+        record_ids(db.session, model, 'deleted', chunk)
+    return query.delete(synchronize_session=False)
+
+
+def delete_ids(model, ids):
+    deleted = 0
+    for chunk in chunks(ids):
+        deleted += delete_where(model, model.id.in_(chunk))
+    return deleted
+
+
+def deleted_response(model, serializer, status=200, query=None):
+    if request.args.get('return') == 'minimal':
+        return Response(status=204)
+    if query is None:
+        query = model.query
+    return serializer(query.all(), many=True).data, status
+
+
+def error_list(errors):
+    return {'errors': [{'index': index, 'errors': errors[index]} for index in sorted(errors)]}
+
+
+def integrity_error_list(form_class, error):
+    # a constraint check_rows() could not foresee; the statement does not say
+    # which item failed, so the error has no index
+    return {'errors': [{'index': None, 'errors': form_class.integrity_errors(error)}]}
+
+
+def validate_items(form_class, items, model, values, defaults=False):
+    # ({index: row of column values}, {index: errors}); with defaults, the
+    # rows get the column defaults an insert would
+    rows, errors = {}, {}
+    for index, item in enumerate(items):
+        form = form_class(item)
+        if form.validate():
+            rows[index] = values(form)
+        else:
+            errors[index] = form.errors
+    if defaults:
+        with_defaults(model.__table__, list(rows.values()))
+    check_rows(model, rows, errors)
+    return rows, errors
+
+
+def model_for(table):
+    for model in db.Model.__subclasses__():
+        if model.__table__ is table:
+            return model
+
+
+def check_rows(model, rows, errors):
+    # What the database would refuse, found before anything is written, so
+    # it is reported by item: a NULL in a required column, or an id of a row
+    # that does not exist (SQLite does not enforce foreign keys here). One IN
+    # query per foreign key column and chunk of ids.
+    table = model.__table__
+    keys = set()
+    for index, row in rows.items():
+        keys.update(row)
+        for key, value in row.items():
+            if value is None and not table.c[key].nullable:
+                errors.setdefault(index, {})[key] = [REQUIRED]
+    for key in sorted(keys):
+        for foreign_key in table.c[key].foreign_keys:
+            found = existing_ids(model_for(foreign_key.column.table),
+                                 [row[key] for row in rows.values() if row.get(key) is not None])
+            for index, row in rows.items():
+                if row.get(key) is not None and row[key] not in found:
+                    errors.setdefault(index, {})[key] = ['Not found']
+
+
+def existing_ids(model, ids):
+    found = set()
+    for chunk in chunks(list(set(ids))):
+        found.update(id for (id,) in db.session.query(model.id).filter(model.id.in_(chunk)))
+    return found
+
+
+def load(model, ids):
+    rows = []
+    for chunk in chunks(ids):
+        rows.extend(model.query.filter(model.id.in_(chunk)).order_by(model.id).all())
+    return rows
+
+
+def with_defaults(table, rows):
+    # A None the form left in a row would be bound as NULL and override the
+    # column default, where the ORM leaves the attribute out. Scalar defaults
+    # are filled in; other defaults only apply when no row has a value.
+    for key in list(rows[0]) if rows else []:
+        default = table.c[key].default
+        if default is None:
+            continue
+        if default.is_scalar:
+            for row in rows:
+                if row[key] is None:
+                    row[key] = default.arg
+        elif all(row[key] is None for row in rows):
+            for row in rows:
+                del row[key]
+    return rows
+
+
+def insert_rows(model, rows):
+    # ids of the inserted rows, in order
+    table = model.__table__
+    if db.session.get_bind(model.__mapper__).dialect.name == 'sqlite':
+        # SQLite has one writer: this transaction holds the write lock from
+        # the insert until the commit, so the new rows are the last len(rows)
+        # rowids and one executemany will do
+        db.session.execute(table.insert(), rows)
+        last = db.session.query(db.func.max(model.id)).scalar()
+        return list(range(last - len(rows) + 1, last + 1))
+    # server databases interleave concurrent inserts; RETURNING where supported
+    return [db.session.execute(table.insert(), row).inserted_primary_key[0] for row in rows]
+
+
+def bulk_create(model, form_class, values, serializer):
+    items = json_items()
+    rows, errors = validate_items(form_class, items, model, values, defaults=True)
+    if errors:
+        return error_list(errors), 422
+    if not items:
+        return [], 201
+
+    rows = [rows[index] for index in range(len(items))]
+    try:
+        ids = insert_rows(model, rows)
+        touch(db.session, [model.__tablename__])
+        for chunk in chunks(ids):
+            record_ids(db.session, model, 'created', chunk)
+        db.session.commit()
+    except IntegrityError as e:
+        db.session.rollback()
+        return integrity_error_list(form_class, e), 422
+    return serializer(load(model, ids), many=True).data, 201
+
+
+def bulk_update(model, form_class, values, serializer):
+    items = json_items()
+    rows, errors = validate_items(form_class, items, model, values)
+    ids = [item.get('id') if isinstance(item, dict) else None for item in items]
+    found = existing_ids(model, [id for id in ids if isinstance(id, int)])
+    for index, id in enumerate(ids):
+        if isinstance(items[index], dict) and not (isinstance(id, int) and id in found):
+            errors.setdefault(index, {})['id'] = ['Not found']
+    if errors:
+        return error_list(errors), 422
+    if not items:
+        return [], 201
+
+    table = model.__table__
+    rows = [dict(rows[index], _id=item['id']) for index, item in enumerate(items)]
+    try:
+        db.session.execute(table.update().where(table.c.id == bindparam('_id')), rows)
+        touch(db.session, [model.__tablename__])
+        for chunk in chunks(ids):
+            record_ids(db.session, model, 'updated', chunk)
+        db.session.commit()
+    except IntegrityError as e:
+        db.session.rollback()
+        return integrity_error_list(form_class, e), 422
+    return serializer(load(model, ids), many=True).data, 201
+
+
+def bulk_delete(model):
+    ids = json_items()
+    found = existing_ids(model, [id for id in ids if isinstance(id, int)])
+    errors = dict((index, {'id': ['Not found']}) for index, id in enumerate(ids)
+                  if not (isinstance(id, int) and id in found))
+    if errors:
+        return error_list(errors), 422
+
+    delete_ids(model, list(found))
+    db.session.commit()
+    if request.args.get('return') == 'minimal':
+        return Response(status=204)
+    return {'deleted': sorted(found)}
@@ -0,0 +1,193 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import request
+from flask.ext.restful.utils import unpack
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from werkzeug.wrappers import BaseResponse
+
+from app.server import app, api
+from app.metrics import count_cache
+
+# Response cache for the small reference tables. Entries are the finished
+# JSON body plus its ETag, tagged with the tables they were read from. A
+# commit that touched one of those tables drops them, and every table has a
+# generation counter so a response computed while that commit was running
+# is never stored.
+
+
+class MemoryCache(object):
+    # LRU dict private to this worker process; the other workers only notice
+    # a change once their copy expires
+
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.generations = {}
+        self.lock = threading.Lock()
+
+    def stamp(self, tables):
+        with self.lock:
+            return tuple(self.generations.get(table, 0) for table in sorted(tables))
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires, tables, value = entry
+            if expires < time.time():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def put(self, key, tables, value, stamp):
+        with self.lock:
+            if tuple(self.generations.get(table, 0) for table in sorted(tables)) != stamp:
+                return
+            self.entries[key] = (time.time() + self.ttl, tables, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, tables):
+        with self.lock:
+            for table in tables:
+                self.generations[table] = self.generations.get(table, 0) + 1
+            for key in [key for key, entry in self.entries.items() if not entry[1].isdisjoint(tables)]:
+                del self.entries[key]
+
+
+class FileCache(object):
+    # The same cache in a local SQLite file, shared by every worker process
+    # on the host, invalidations included. Stands in for memcached or redis.
+
+    def __init__(self, path, size, ttl):
+        self.path = path
+        self.size = size
+        self.ttl = ttl
+        self.local = threading.local()
+
+    def connection(self):
+        # one connection per thread, reopened after a fork
+        if getattr(self.local, 'pid', None) != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute('PRAGMA journal_mode = WAL')
+            connection.execute('PRAGMA synchronous = OFF')
+            connection.execute('CREATE TABLE IF NOT EXISTS cache_entry (key TEXT PRIMARY KEY, tables TEXT, '
+                               'etag TEXT, body BLOB, expires REAL, used REAL)')
+            connection.execute('CREATE TABLE IF NOT EXISTS cache_generation (name TEXT PRIMARY KEY, generation INTEGER)')
+            self.local.connection, self.local.pid = connection, os.getpid()
+        return self.local.connection
+
+    def _stamp(self, connection, tables):
+        tables = sorted(tables)
+        rows = dict(connection.execute('SELECT name, generation FROM cache_generation WHERE name IN (%s)'
+                                       % ', '.join('?' * len(tables)), tables).fetchall())
+        return tuple(rows.get(table, 0) for table in tables)
+
+    def stamp(self, tables):
+        return self._stamp(self.connection(), tables)
+
+    def get(self, key):
+        connection = self.connection()
+        now = time.time()
+        row = connection.execute('SELECT etag, body, used FROM cache_entry WHERE key = ? AND expires > ?',
+                                 (key, now)).fetchone()
+        if row is None:
+            return None
+        if row[2] < now - 1:
+            # LRU order to the second, so hits rarely write
+            connection.execute('UPDATE cache_entry SET used = ? WHERE key = ?', (now, key))
+        return row[0], bytes(row[1])
+
+    def put(self, key, tables, value, stamp):
+        connection = self.connection()
+        now = time.time()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            if self._stamp(connection, tables) == stamp:
+                connection.execute('INSERT OR REPLACE INTO cache_entry VALUES (?, ?, ?, ?, ?, ?)',
+                                   (key, ',%s,' % ','.join(sorted(tables)), value[0], sqlite3.Binary(value[1]),
+                                    now + self.ttl, now))
+                connection.execute('DELETE FROM cache_entry WHERE key IN '
+                                   '(SELECT key FROM cache_entry ORDER BY used DESC LIMIT -1 OFFSET ?)', (self.size,))
+        finally:
+            connection.execute('COMMIT')
+
+    def invalidate(self, tables):
+        connection = self.connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            for table in tables:
+                connection.execute('INSERT OR IGNORE INTO cache_generation VALUES (?, 0)', (table,))
+                connection.execute('UPDATE cache_generation SET generation = generation + 1 WHERE name = ?', (table,))
+                connection.execute('DELETE FROM cache_entry WHERE tables LIKE ?', ('%%,%s,%%' % table,))
+        finally:
+            connection.execute('COMMIT')
+
+
+def make_cache(config):
+    backend = config['RESPONSE_CACHE']
+    if backend == 'memory':
+        return MemoryCache(config['RESPONSE_CACHE_SIZE'], config['RESPONSE_CACHE_TTL'])
+    if backend == 'file':
+        return FileCache(config['RESPONSE_CACHE_PATH'], config['RESPONSE_CACHE_SIZE'], config['RESPONSE_CACHE_TTL'])
+    return None
+
+
+cache = make_cache(app.config)
+
+
+@event.listens_for(Session, 'after_commit')
+def invalidate_committed(session):
+    tables = session.info.pop('touched_tables', None)
+    if tables and cache is not None:
+        cache.invalidate(tables)
+
+
+@event.listens_for(Session, 'after_rollback')
+def forget_rolled_back(session):
+    session.info.pop('touched_tables', None)
+
+
+def cached_response(etag, body):
+    if request.if_none_match.contains_weak(etag):
+        response = app.response_class(status=304)
+    else:
+        response = app.response_class(body, mimetype='application/json')
+    response.set_etag(etag)
+    return response
+
+
+def cached(*models):
+    # goes above @etagged, so a hit needs neither the ORM nor the version table
+    tables = frozenset(model.__tablename__ for model in models)
+
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            if cache is None:
+                return f(*args, **kwargs)
+            key = request.full_path
+            value = cache.get(key)
+            count_cache('response', value is not None)
+            if value is not None:
+                return cached_response(*value)
+
+            stamp = cache.stamp(tables)
+            rv = f(*args, **kwargs)
+            response = rv if isinstance(rv, BaseResponse) else api.make_response(*unpack(rv))
+            etag, weak = response.get_etag()
+            if response.status_code == 200 and etag:
+                cache.put(key, tables, (etag, response.get_data()), stamp)
+            return response
+        return wrapper
+    return decorator
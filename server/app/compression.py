@@ -0,0 +1,152 @@
+import threading
+import zlib
+from collections import OrderedDict
+
+from flask import request
+
+from app.server import app
+from app.metrics import count_cache
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Compresses JSON and text bodies of COMPRESSION_MIN_SIZE bytes or more with
+# brotli (if installed) or gzip, whichever the client accepts and prefers.
+# A compressed body whose response has an ETag is kept by (ETag, coding);
+# the ETag changes with the versions of the tables behind the body, so hot
+# endpoints are compressed once per change rather than once per request.
+# The ETag is marked weak, as the bytes differ per coding. Streamed lists
+# are compressed as they are sent, whatever their size.
+
+COMPRESSIBLE = ('application/json', 'text/plain')
+
+
+def gzip_body(data):
+    compressor = zlib.compressobj(app.config['COMPRESSION_LEVEL'], zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+def brotli_body(data):
+    return brotli.compress(data, quality=app.config['BROTLI_QUALITY'])
+
+
+def gzip_stream(chunks):
+    compressor = zlib.compressobj(app.config['COMPRESSION_LEVEL'], zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def brotli_stream(chunks):
+    compressor = brotli.Compressor(quality=app.config['BROTLI_QUALITY'])
+    for chunk in chunks:
+        data = compressor.process(chunk)
+        if data:
+            yield data
+    yield compressor.finish()
+
+
+# (coding, whole body, stream of chunks), preferred first
+CODINGS = [('br', brotli_body, brotli_stream)] if brotli is not None else []
+CODINGS.append(('gzip', gzip_body, gzip_stream))
+
+
+def encoded(iterable):
+    # the chunks of a streamed body as bytes; closing it closes the body,
+    # which ends its stream_with_context
+    try:
+        for chunk in iterable:
+            yield chunk.encode('utf-8') if isinstance(chunk, str) else chunk
+    finally:
+        close = getattr(iterable, 'close', None)
+        if close is not None:
+            close()
+
+
+class CompressedCache(object):
+    # LRU of compressed bodies private to this worker process, bounded in bytes
+
+    def __init__(self, size):
+        self.size = size
+        self.used = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            body = self.entries.get(key)
+            if body is not None:
+                self.entries.move_to_end(key)
+            return body
+
+    def put(self, key, body):
+        if len(body) > self.size:
+            return
+        with self.lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.used -= len(previous)
+            self.entries[key] = body
+            self.used += len(body)
+            while self.used > self.size:
+                self.used -= len(self.entries.popitem(last=False)[1])
+
+
+compressed_cache = CompressedCache(app.config['COMPRESSION_CACHE_SIZE'])
+
+
+def negotiate(accept_encodings):
+    best, best_quality = None, 0
+    for coding, compress_body, compress_stream in CODINGS:
+        quality = accept_encodings[coding]
+        if quality > best_quality:
+            best, best_quality = (coding, compress_body, compress_stream), quality
+    return best
+
+
+def compressible(response):
+    return (not response.direct_passthrough and response.mimetype in COMPRESSIBLE
+            and 'Content-Encoding' not in response.headers)
+
+
+@app.after_request
+def compress(response):
+    if not app.config['COMPRESSION'] or not (compressible(response) or response.status_code == 304):
+        return response
+    response.vary.add('Accept-Encoding')
+    if response.status_code != 200 or request.method == 'HEAD':
+        return response
+    chosen = negotiate(request.accept_encodings)
+    if chosen is None:
+        return response
+    coding, compress_body, compress_stream = chosen
+    if response.is_streamed:
+        response.response = compress_stream(encoded(response.response))
+        response.headers.pop('Content-Length', None)
+        response.headers['Content-Encoding'] = coding
+        return response
+
+    data = response.get_data()
+    if len(data) < app.config['COMPRESSION_MIN_SIZE']:
+        return response
+    etag, weak = response.get_etag()
+    body = None
+    if etag:
+        key = (etag, coding)
+        body = compressed_cache.get(key)
+        count_cache('compressed', body is not None)
+    if body is None:
+        body = compress_body(data)
+        if etag:
+            compressed_cache.put(key, body)
+    if len(body) >= len(data):
+        return response
+    response.set_data(body)
+    response.headers['Content-Encoding'] = coding
+    if etag:
+        response.set_etag(etag, weak=True)
+    return response
@@ -1,2 +1,136 @@
+import multiprocessing
+import os
+import tempfile
+
+
+def env_int(name, default=None):
+    return int(os.environ[name]) if name in os.environ else default
+
+
 DEBUG = True
 WTF_CSRF_ENABLED = False
+
+# cursor pagination (?limit=&cursor=) on list endpoints
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+# signs bearer tokens issued by POST /api/v1/sessions
+SECRET_KEY = os.environ.get('TAGMATIC_SECRET_KEY', 'development-secret-key')
+TOKEN_EXPIRATION = 24 * 60 * 60
+# HTTP Basic credentials kept after a successful bcrypt check
+CREDENTIAL_CACHE_SIZE = 1024
+
+# list endpoints with flat serializers build rows from column tuples and
+# stream unpaginated results in chunks of STREAM_CHUNK_SIZE
+FAST_SERIALIZERS = True
+STREAM_CHUNK_SIZE = 500
+# 'json' keeps the output byte for byte what flask-restful writes; 'orjson'
+# (if installed, ignored in DEBUG) is faster but compact
+JSON_ENCODER = os.environ.get('TAGMATIC_JSON_ENCODER', 'json')
+
+# any SQLAlchemy URL; defaults to app.sqlite next to run.py
+DATABASE_URL = os.environ.get('TAGMATIC_DATABASE_URL')
+# optional read-only copy that GET and HEAD requests query instead
+DATABASE_REPLICA_URL = os.environ.get('TAGMATIC_DATABASE_REPLICA_URL')
+# connection pool of server databases, None keeps the SQLAlchemy default
+DATABASE_POOL_SIZE = env_int('TAGMATIC_DATABASE_POOL_SIZE')
+DATABASE_MAX_OVERFLOW = env_int('TAGMATIC_DATABASE_MAX_OVERFLOW')
+DATABASE_POOL_TIMEOUT = env_int('TAGMATIC_DATABASE_POOL_TIMEOUT')
+DATABASE_POOL_RECYCLE = env_int('TAGMATIC_DATABASE_POOL_RECYCLE')
+# set on every new SQLite connection
+SQLITE_WAL = os.environ.get('TAGMATIC_SQLITE_WAL', '1') != '0'
+SQLITE_BUSY_TIMEOUT = env_int('TAGMATIC_SQLITE_BUSY_TIMEOUT', 5000)  # milliseconds
+SQLITE_MMAP_SIZE = env_int('TAGMATIC_SQLITE_MMAP_SIZE', 256 * 1024 * 1024)
+
+# ?since= delta sync: the returned token lags the database clock by
+# SYNC_WINDOW seconds, and tokens older than TOMBSTONE_RETENTION days get a 410
+SYNC_WINDOW = 5
+TOMBSTONE_RETENTION = 30
+
+# /api/v1/projects/<id>/stats reads per-group counters that SQLite triggers
+# keep in issue_count; run db_stats_rebuild.py after changing this
+ISSUE_COUNTERS = True
+# issues in these columns count as done for milestone completion
+DONE_COLUMNS = ('Done',)
+
+# finished responses of the tag, effort, milestone, column and contact
+# endpoints: 'memory' (per worker process), 'file' (shared by the workers on
+# this host) or 'none'
+RESPONSE_CACHE = os.environ.get('TAGMATIC_RESPONSE_CACHE', 'memory')
+RESPONSE_CACHE_SIZE = 1024
+RESPONSE_CACHE_TTL = 60  # seconds
+RESPONSE_CACHE_PATH = os.environ.get('TAGMATIC_RESPONSE_CACHE_PATH',
+                                     os.path.join(tempfile.gettempdir(), 'tagmatic-cache.sqlite'))
+
+# /api/v1/projects/<id>/events: 'memory' delivers within one worker process,
+# 'file' through a SQLite file every worker on this host polls, 'none' is off
+EVENT_BUS = os.environ.get('TAGMATIC_EVENT_BUS', 'memory')
+EVENT_BUS_PATH = os.environ.get('TAGMATIC_EVENT_BUS_PATH', os.path.join(tempfile.gettempdir(), 'tagmatic-events.sqlite'))
+EVENT_BUS_INTERVAL = 0.5  # seconds between polls of the file bus
+EVENT_QUEUE_SIZE = 100  # events buffered per stream before it is told to reset
+EVENT_HEARTBEAT = 15  # seconds
+# streams open at once per worker process, each holding a thread unless the
+# worker runs gevent; serve.py lowers it to half the threads of a threaded
+# worker so the other half keeps serving the API. Past it streams get a 503.
+EVENT_MAX_STREAMS = env_int('TAGMATIC_EVENT_MAX_STREAMS', 1000)
+
+# POST /api/v1/batch and GET /api/v1/bootstrap: sub-requests per batch, and
+# the threads per worker process that run them with ?parallel=1
+BATCH_MAX_REQUESTS = 20
+BATCH_THREADS = 4
+
+# gzip, or brotli if installed, for JSON and text bodies of at least
+# COMPRESSION_MIN_SIZE bytes (app/compression.py); compressed bodies of
+# responses with an ETag are kept in COMPRESSION_CACHE_SIZE bytes per worker
+COMPRESSION = os.environ.get('TAGMATIC_COMPRESSION', '1') != '0'
+COMPRESSION_MIN_SIZE = env_int('TAGMATIC_COMPRESSION_MIN_SIZE', 1024)
+COMPRESSION_LEVEL = env_int('TAGMATIC_COMPRESSION_LEVEL', 6)  # gzip, 1 to 9
+BROTLI_QUALITY = env_int('TAGMATIC_BROTLI_QUALITY', 5)  # 0 to 11
+COMPRESSION_CACHE_SIZE = 32 * 1024 * 1024
+
+# per-request profiling (app/profiling.py): the share of requests measured,
+# whether measured ones get a Server-Timing header, and the duration above
+# which they are logged with their SQL statements
+PROFILE_SAMPLE_RATE = float(os.environ.get('TAGMATIC_PROFILE_SAMPLE_RATE', '1.0'))
+PROFILE_HEADER = True
+SLOW_REQUEST_MS = env_int('TAGMATIC_SLOW_REQUEST_MS', 500)
+# also run measured requests under cProfile and write the slow ones here as
+# .prof files; costly, None is off
+PROFILE_DUMP_DIR = os.environ.get('TAGMATIC_PROFILE_DUMP_DIR')
+
+# GET /metrics in the Prometheus text format: 'memory' reports this worker
+# process only, 'file' adds up every worker on this host through snapshots
+# each one writes to METRICS_PATH every METRICS_INTERVAL seconds, 'none' is off
+METRICS = os.environ.get('TAGMATIC_METRICS', 'memory')
+METRICS_PATH = os.environ.get('TAGMATIC_METRICS_PATH', os.path.join(tempfile.gettempdir(), 'tagmatic-metrics'))
+METRICS_INTERVAL = 1.0
+
+# password hashing (app/passwords.py): bcrypt cost, and a pool of
+# BCRYPT_WORKERS 'thread's or 'process'es ('none' hashes in the request
+# thread); beyond BCRYPT_QUEUE_SIZE waiting hashes requests get a 503.
+# Stored hashes of another cost are redone at the user's next login.
+BCRYPT_LOG_ROUNDS = env_int('TAGMATIC_BCRYPT_ROUNDS', 12)
+BCRYPT_POOL = os.environ.get('TAGMATIC_BCRYPT_POOL', 'thread')
+BCRYPT_WORKERS = env_int('TAGMATIC_BCRYPT_WORKERS', 2)
+BCRYPT_QUEUE_SIZE = env_int('TAGMATIC_BCRYPT_QUEUE_SIZE', 16)
+
+# serve.py, the production server (gunicorn): address, worker processes,
+# threads per worker and seconds an idle keep-alive connection stays open.
+# Workers are forked after the app is loaded when SERVER_PRELOAD is on.
+SERVER_BIND = os.environ.get('TAGMATIC_BIND', '127.0.0.1:5005')
+SERVER_WORKERS = env_int('TAGMATIC_WORKERS', multiprocessing.cpu_count() * 2 + 1)
+SERVER_THREADS = env_int('TAGMATIC_THREADS', 8)
+SERVER_KEEPALIVE = env_int('TAGMATIC_KEEPALIVE', 5)
+SERVER_TIMEOUT = 30  # seconds a worker may go silent before it is restarted
+SERVER_GRACEFUL_TIMEOUT = 30  # seconds a reload waits for requests in flight
+SERVER_PRELOAD = os.environ.get('TAGMATIC_PRELOAD', '1') != '0'
+
+
+class Production(object):
+    # create_app('production') and serve.py: no debugger, compact JSON, and
+    # the backends that are shared by several worker processes
+    DEBUG = False
+    RESPONSE_CACHE = os.environ.get('TAGMATIC_RESPONSE_CACHE', 'file')
+    EVENT_BUS = os.environ.get('TAGMATIC_EVENT_BUS', 'file')
+    METRICS = os.environ.get('TAGMATIC_METRICS', 'file')
+    PROFILE_SAMPLE_RATE = float(os.environ.get('TAGMATIC_PROFILE_SAMPLE_RATE', '0.01'))
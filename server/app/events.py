@@ -0,0 +1,211 @@
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app.server import app, db
+from app.models import Issue, Column, Tag
+
+# Live board updates. Writes to issues, columns and tags are recorded in the
+# session and published once the transaction commits: issue events on the
+# channel of their project, column and tag events (which every board shows)
+# on the shared channel. /api/v1/projects/<id>/events relays both channels
+# to the browser as Server-Sent Events.
+
+EVENT_MODELS = dict((model.__tablename__, model) for model in (Issue, Column, Tag))
+SHARED_CHANNEL = 'all'
+
+
+def project_channel(project_id):
+    return 'project:%s' % project_id
+
+
+class Subscription(object):
+    def __init__(self, channels, size):
+        self.channels = channels
+        self.queue = queue.Queue(size)
+        self.overflowed = False
+
+    def put(self, message):
+        try:
+            self.queue.put_nowait(message)
+        except queue.Full:
+            # a stalled reader loses events; it is told to refetch instead
+            self.overflowed = True
+
+    def get(self, timeout):
+        if self.overflowed:
+            self.overflowed = False
+            with self.queue.mutex:
+                self.queue.queue.clear()
+            return format_event('reset', {})
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class MemoryBus(object):
+    # fans messages out to the subscribers in this worker process only
+
+    def __init__(self, queue_size):
+        self.queue_size = queue_size
+        self.subscribers = defaultdict(set)
+        self.lock = threading.Lock()
+
+    def subscribe(self, channels):
+        subscription = Subscription(channels, self.queue_size)
+        with self.lock:
+            for channel in channels:
+                self.subscribers[channel].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            for channel in subscription.channels:
+                self.subscribers[channel].discard(subscription)
+                if not self.subscribers[channel]:
+                    del self.subscribers[channel]
+
+    def deliver(self, channel, message):
+        with self.lock:
+            subscribers = list(self.subscribers.get(channel, ()))
+        for subscription in subscribers:
+            subscription.put(message)
+
+    def publish(self, channel, message):
+        self.deliver(channel, message)
+
+
+class FileBus(MemoryBus):
+    # Messages go through a local SQLite file that one poller thread per
+    # worker process reads and hands to its own subscribers, so every worker
+    # on the host sees every event. Stands in for redis pub/sub.
+
+    def __init__(self, path, queue_size, interval, keep=60):
+        MemoryBus.__init__(self, queue_size)
+        self.path = path
+        self.interval = interval
+        self.keep = keep
+        self.local = threading.local()
+        self.poller_pid = None
+        self.poller_lock = threading.Lock()
+
+    def connection(self):
+        if getattr(self.local, 'pid', None) != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute('PRAGMA journal_mode = WAL')
+            connection.execute('PRAGMA synchronous = OFF')
+            connection.execute('CREATE TABLE IF NOT EXISTS bus_message (id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                               'channel TEXT, message TEXT, created REAL)')
+            self.local.connection, self.local.pid = connection, os.getpid()
+        return self.local.connection
+
+    def publish(self, channel, message):
+        connection = self.connection()
+        now = time.time()
+        connection.execute('INSERT INTO bus_message (channel, message, created) VALUES (?, ?, ?)',
+                           (channel, message, now))
+        connection.execute('DELETE FROM bus_message WHERE created < ?', (now - self.keep,))
+
+    def subscribe(self, channels):
+        with self.poller_lock:
+            if self.poller_pid != os.getpid():
+                self.poller_pid = os.getpid()
+                poller = threading.Thread(target=self.poll)
+                poller.daemon = True
+                poller.start()
+        return MemoryBus.subscribe(self, channels)
+
+    def poll(self):
+        connection = self.connection()
+        last = connection.execute('SELECT coalesce(max(id), 0) FROM bus_message').fetchone()[0]
+        while True:
+            time.sleep(self.interval)
+            for id, channel, message in connection.execute(
+                    'SELECT id, channel, message FROM bus_message WHERE id > ? ORDER BY id', (last,)).fetchall():
+                self.deliver(channel, message)
+                last = id
+
+
+def make_bus(config):
+    backend = config['EVENT_BUS']
+    if backend == 'memory':
+        return MemoryBus(config['EVENT_QUEUE_SIZE'])
+    if backend == 'file':
+        return FileBus(config['EVENT_BUS_PATH'], config['EVENT_QUEUE_SIZE'], config['EVENT_BUS_INTERVAL'])
+    return None
+
+
+bus = make_bus(app.config)
+
+# taken by each open stream of this worker process, see EVENT_MAX_STREAMS
+stream_slots = threading.BoundedSemaphore(app.config['EVENT_MAX_STREAMS'])
+
+
+def format_event(kind, data):
+    return 'event: %s\ndata: %s\n\n' % (kind, json.dumps(data))
+
+
+def record(session, table_name, action, rows):
+    # rows are (id, project_id) pairs; project_id is None for shared data
+    if bus is None or table_name not in EVENT_MODELS or not rows:
+        return
+    pending = session.info.setdefault('events', defaultdict(list))
+    for id, project_id in rows:
+        pending[(table_name, action, project_id)].append(id)
+
+
+def record_ids(session, model, action, ids):
+    # for the bulk statements, which bypass the unit of work; ids come in
+    # chunks small enough for one IN clause
+    if bus is None or model.__tablename__ not in EVENT_MODELS or not ids:
+        return
+    if not hasattr(model, 'project_id'):
+        record(session, model.__tablename__, action, [(id, None) for id in ids])
+        return
+    record(session, model.__tablename__, action,
+           session.query(model.id, model.project_id).filter(model.id.in_(ids)).all())
+
+
+@event.listens_for(Session, 'after_flush')
+def record_flushed(session, flush_context):
+    for action, objects in (('created', session.new), ('updated', session.dirty), ('deleted', session.deleted)):
+        for obj in objects:
+            if action == 'updated' and not session.is_modified(obj, include_collections=False):
+                continue
+            record(session, obj.__tablename__, action, [(obj.id, getattr(obj, 'project_id', None))])
+
+
+@event.listens_for(Session, 'after_commit')
+def publish_committed(session):
+    pending = session.info.pop('events', None)
+    if not pending:
+        return
+    for (table_name, action, project_id), ids in sorted(pending.items(), key=lambda item: str(item[0])):
+        channel = SHARED_CHANNEL if project_id is None else project_channel(project_id)
+        bus.publish(channel, format_event(table_name, {'action': action, 'ids': sorted(set(ids))}))
+
+
+@event.listens_for(Session, 'after_rollback')
+def forget_rolled_back(session):
+    session.info.pop('events', None)
+
+
+def event_stream(project_id):
+    subscription = bus.subscribe([project_channel(project_id), SHARED_CHANNEL])
+    heartbeat = app.config['EVENT_HEARTBEAT']
+    try:
+        yield 'retry: 3000\n\n'
+        while True:
+            message = subscription.get(heartbeat)
+            # comment lines keep proxies from closing an idle stream
+            yield message if message is not None else ': keepalive\n\n'
+    finally:
+        bus.unsubscribe(subscription)
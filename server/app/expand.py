@@ -0,0 +1,79 @@
+from flask import request
+from flask.ext.restful import abort
+from sqlalchemy import inspect
+
+from app.server import db
+from app import fastpath
+from app.bulk import chunks
+
+# ?expand=tag,project inlines the objects an item's foreign keys point at,
+# next to the ids: item['tag'] for item['tag_id']. Items are expanded after
+# they are serialized, a list or stream chunk at a time. Each relation takes
+# one IN query per CHUNK_SIZE ids of a list; a stream loads every object its
+# items refer to up front, with one query per relation, rather than a query
+# per chunk. Every object is serialized once however many items refer to it.
+# Deletes clear the nullable foreign keys to deleted rows (app/bulk.py), so an
+# id is expanded to null only when it is null itself.
+
+
+class Expands(object):
+    def __init__(self, model, serializers):
+        # relationship name -> serializer of the objects it points at
+        mapper = inspect(model)
+        self.model = model
+        self.relations = {}
+        for name, serializer in serializers.items():
+            relationship = mapper.relationships[name]
+            column, = relationship.local_columns
+            self.relations[name] = (column.key, relationship.mapper.class_, serializer)
+
+    def requested(self):
+        names = [name.strip() for name in request.args.get('expand', '').split(',') if name.strip()]
+        for name in names:
+            if name not in self.relations:
+                abort(400, message='Cannot expand %s' % name)
+        return sorted(set(names))
+
+    def models(self):
+        # the tables an expanded response depends on, for its ETag
+        return [self.relations[name][1] for name in self.requested()]
+
+    def expander(self):
+        names = self.requested()
+        if not names:
+            return None
+        return Expander(self.model, [(name,) + self.relations[name] for name in names])
+
+
+class Expander(object):
+    def __init__(self, model, relations):
+        self.model = model
+        self.relations = relations  # (name, foreign key, model, serializer)
+        self.loaded = dict((name, {}) for name, key, model, serializer in relations)
+        self.complete = False
+
+    def preload(self, query):
+        # every object the items of query refer to, before they are streamed
+        for name, key, model, serializer in self.relations:
+            ids = query.with_entities(getattr(self.model, key)).order_by(None).distinct().subquery()
+            for item in load(model, serializer, ids):
+                self.loaded[name][item['id']] = item
+        self.complete = True
+
+    def __call__(self, items):
+        for name, key, model, serializer in self.relations:
+            known = self.loaded[name]
+            missing = set() if self.complete else set(item[key] for item in items if item[key]) - set(known)
+            for chunk in chunks(sorted(missing)):
+                for item in load(model, serializer, chunk):
+                    known[item['id']] = item
+            for item in items:
+                item[name] = known.get(item[key])
+        return items
+
+
+def load(model, serializer, ids):
+    if fastpath.supports(serializer):
+        query = db.session.query(*fastpath.columns(model, serializer)).filter(model.id.in_(ids))
+        return fastpath.serialize_rows(serializer, query.all())
+    return serializer(model.query.filter(model.id.in_(ids)).all(), many=True).data
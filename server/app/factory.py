@@ -0,0 +1,70 @@
+import os
+import sys
+
+from flask import Config
+
+# create_app() chooses the settings the app is built with. Every module
+# imports the app, db and api from app.server, which builds them when it is
+# first imported, so there is one app per process and create_app() has to
+# run before that import. Settings apply in this order: app/config.py, the
+# profile, the TAGMATIC_SETTINGS file, then a dict given to create_app().
+
+PROFILES = {
+    'development': None,
+    'production': 'app.config.Production',
+}
+
+basedir = os.path.join(os.path.abspath(os.path.dirname(__file__)), '../')
+
+# what app.server is built with; create_app() sets it first
+chosen = {'profile': os.environ.get('TAGMATIC_PROFILE', 'development'), 'settings': {}}
+
+
+def configure(config, profile, settings):
+    if profile not in PROFILES:
+        raise ValueError('unknown profile %r, expected one of %s' % (profile, ', '.join(sorted(PROFILES))))
+    config.from_object('app.config')
+    if PROFILES[profile] is not None:
+        config.from_object(PROFILES[profile])
+    # optional file of overrides: TAGMATIC_SETTINGS=/etc/tagmatic.cfg
+    config.from_envvar('TAGMATIC_SETTINGS', silent=True)
+    config.update(settings)
+    config['PROFILE'] = profile
+    return config
+
+
+def split(config):
+    # (profile, settings) of a profile name, a dict with an optional
+    # 'PROFILE' key, or None for TAGMATIC_PROFILE
+    if config is None:
+        return chosen['profile'], {}
+    if isinstance(config, str):
+        return config, {}
+    settings = dict(config)
+    return settings.pop('PROFILE', chosen['profile']), settings
+
+
+def load_config(config=None):
+    # the settings create_app(config) would use, without building the app
+    profile, settings = split(config)
+    return configure(Config(basedir), profile, settings)
+
+
+def create_app(config=None):
+    profile, settings = split(config)
+    if 'app.server' not in sys.modules:
+        chosen['profile'], chosen['settings'] = profile, settings
+    from app.server import app
+    if app.config['PROFILE'] != profile or any(app.config.get(key) != value for key, value in settings.items()):
+        raise RuntimeError('the app was already built with other settings; call create_app() before '
+                           'anything imports app.server')
+    return app
+
+
+def dispose_engines():
+    # Drops the pooled connections of this process, so processes forked
+    # after it open their own instead of sharing its sockets.
+    from app.server import db
+    for engine in (db.engine, db.replica):
+        if engine is not None:
+            engine.dispose()
@@ -0,0 +1,125 @@
+import json
+from calendar import timegm
+from datetime import datetime
+
+from flask import current_app, stream_with_context
+
+from app.profiling import serializing
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Row-to-dict functions compiled from a serializer's Meta.fields. They run on
+# plain column tuples and reproduce what marshmallow would output for the
+# same rows, including its habit of picking each field's type from the first
+# row: a field that is None there stays raw for the whole response, one that
+# holds a str becomes a String field that renders later Nones as ''.
+
+KINDS = {str: 'string', bytes: 'string', int: 'integer', bool: 'boolean', float: 'float', datetime: 'datetime'}
+
+FORMATS = {
+    'string': "('' if {v} is None else str({v}))",
+    'integer': "(0 if {v} is None else int({v}))",
+    'float': "(0.0 if {v} is None else float({v}))",
+    'boolean': "(None if {v} is None else bool({v}))",
+    'datetime': "(None if {v} is None else rfc822({v}))",
+    'raw': "{v}",
+}
+
+DAYS = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+MONTHS = ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec')
+
+_compiled = {}
+
+
+def rfc822(value):
+    # same output as marshmallow's rfcformat() without the email.utils round trip
+    if value.tzinfo is not None:
+        value = datetime.utcfromtimestamp(timegm(value.utctimetuple()))
+    return '%s, %02d %s %04d %02d:%02d:%02d -0000' % (
+        DAYS[value.weekday()], value.day, MONTHS[value.month - 1], value.year,
+        value.hour, value.minute, value.second)
+
+
+def supports(serializer):
+    return not serializer._declared_fields
+
+
+def columns(model, serializer):
+    return [getattr(model, name) for name in serializer.Meta.fields]
+
+
+def compile_row(fields, kinds):
+    key = (fields, kinds)
+    function = _compiled.get(key)
+    if function is None:
+        names = ['v%d' % index for index in range(len(fields))]
+        items = ['%r: %s' % (field, FORMATS[kind].format(v=name)) for field, kind, name in zip(fields, kinds, names)]
+        source = 'def row_to_dict(row):\n    %s, = row[:%d]\n    return {%s}\n' % (
+            ', '.join(names), len(fields), ', '.join(items))
+        namespace = {'rfc822': rfc822}
+        exec(source, namespace)
+        function = _compiled[key] = namespace['row_to_dict']
+    return function
+
+
+def row_function(serializer, first_row):
+    fields = tuple(serializer.Meta.fields)
+    kinds = tuple(KINDS.get(type(value), 'raw') for value in first_row[:len(fields)])
+    return compile_row(fields, kinds)
+
+
+def serialize_rows(serializer, rows):
+    if not rows:
+        return []
+    with serializing():
+        row_to_dict = row_function(serializer, rows[0])
+        return [row_to_dict(row) for row in rows]
+
+
+def use_orjson():
+    return orjson is not None and current_app.config['JSON_ENCODER'] == 'orjson' and not current_app.debug
+
+
+def encode_items(items):
+    # Encodes a slice of a JSON array exactly as flask-restful's output_json
+    # would lay it out inside the full array.
+    with serializing():
+        if use_orjson():
+            return b','.join(orjson.dumps(item) for item in items)
+        if current_app.debug:
+            return ',\n    '.join(json.dumps(item, indent=4, sort_keys=True).replace('\n', '\n    ') for item in items)
+        return ', '.join(json.dumps(item) for item in items)
+
+
+def stream_array(serializer, query, extend=None):
+    # extend(items), if given, runs on each chunk before it is encoded
+    chunk_size = current_app.config['STREAM_CHUNK_SIZE']
+    if use_orjson():
+        empty, opening, separator, closing = b'[]', b'[', b',', b']'
+    elif current_app.debug:
+        empty, opening, separator, closing = '[]\n', '[\n    ', ',\n    ', '\n]\n'
+    else:
+        empty, opening, separator, closing = '[]', '[', ', ', ']'
+
+    def generate():
+        rows = iter(query.yield_per(chunk_size))
+        first = next(rows, None)
+        if first is None:
+            yield empty
+            return
+        row_to_dict = row_function(serializer, first)
+        chunk = [row_to_dict(first)]
+        prefix = opening
+        for row in rows:
+            chunk.append(row_to_dict(row))
+            if len(chunk) >= chunk_size:
+                yield prefix + encode_items(extend(chunk) if extend else chunk)
+                prefix, chunk = separator, []
+        if chunk:
+            yield prefix + encode_items(extend(chunk) if extend else chunk)
+        yield closing
+
+    return current_app.response_class(stream_with_context(generate()), mimetype='application/json')
@@ -0,0 +1,52 @@
+from datetime import datetime
+
+from flask import request
+from flask.ext.restful import abort
+
+from app.server import db
+
+
+def column_type(attribute):
+    return attribute.property.columns[0].type
+
+
+def bind_value(value):
+    # SQLite compares datetimes as text and CURRENT_TIMESTAMP defaults are
+    # stored without microseconds, so bind in the same shape as the stored value
+    if isinstance(value, datetime) and db.engine.name == 'sqlite':
+        return db.literal(value.strftime('%Y-%m-%d %H:%M:%S' if not value.microsecond else '%Y-%m-%d %H:%M:%S.%f'))
+    return value
+
+
+def parse_value(attribute, value):
+    if value == 'null':
+        return None
+    kind = column_type(attribute)
+    if isinstance(kind, db.Boolean):
+        return value.lower() in ('1', 'true', 'yes')
+    if isinstance(kind, db.Integer):
+        try:
+            return int(value)
+        except ValueError:
+            abort(400, message='%s must be an integer' % attribute.key)
+    return value
+
+
+def apply_filters(query, model, filters):
+    # ?project_id=1&tag_id=2,3&assigned_to_id=null -> WHERE project_id = 1
+    # AND tag_id IN (2, 3) AND assigned_to_id IS NULL
+    for name in filters:
+        if name not in request.args:
+            continue
+        attribute = getattr(model, name)
+        values = [parse_value(attribute, value) for value in request.args[name].split(',')]
+        present = [value for value in values if value is not None]
+        clauses = []
+        if len(present) == 1:
+            clauses.append(attribute == present[0])
+        elif present:
+            clauses.append(attribute.in_(present))
+        if None in values:
+            clauses.append(attribute == None)
+        query = query.filter(db.or_(*clauses))
+    return query
@@ -5,10 +5,14 @@ from wtforms import StringField, BooleanField, IntegerField, DateTimeField
 from wtforms.validators import DataRequired
 
 from app.server import db
+from app.validation import compiled
 from app.models import User, Post, ToDo, Contact, Project, Issue, Tag, Milestone, Effort, Column
 
 BaseModelForm = model_form_factory(Form)
 
+# The classes below describe the request bodies; @compiled turns each into a
+# schema (app/validation.py), so views never bind a form per request.
+
 
 class ModelForm(BaseModelForm):
     @classmethod
@@ -16,54 +20,64 @@ class ModelForm(BaseModelForm):
         return db.session
 
 
+@compiled
 class UserCreateForm(ModelForm):
     class Meta:
         model = User
 
 
+@compiled
 class SessionCreateForm(Form):
     email = StringField('email', validators=[DataRequired()])
     password = StringField('password', validators=[DataRequired()])
 
 
+@compiled
 class PostCreateForm(ModelForm):
     class Meta:
         model = Post
 
 
+@compiled
 class ToDoCreateForm(ModelForm):
     class Meta:
         model = ToDo
 
 
+@compiled
 class ToDoCompleteForm(Form):
     text = StringField('text')
     is_complete = BooleanField('is_complete')
 
 
+@compiled
 class ContactCreateForm(ModelForm):
     class Meta:
         model = Contact
 
 
+@compiled
 class ContactUpdateForm(Form):
     first_name = StringField('first_name')
     last_name = StringField('last_name')
     text = StringField('text')
 
 
+@compiled
 class ProjectCreateForm(ModelForm):
     name = StringField('name')
     description = StringField('description')
     user_id = IntegerField('user_id')
 
 
+@compiled
 class ProjectUpdateForm(Form):
     name = StringField('name')
     description = StringField('description')
     user_id = IntegerField('user_id')
 
 
+@compiled
 class IssueCreateForm(ModelForm):
     title = StringField('title')
     description = StringField('description')
@@ -74,21 +88,32 @@ class IssueCreateForm(ModelForm):
     effort_id = IntegerField('effort_id')
     assigned_to_id = IntegerField('assigned_to_id')
 
+@compiled
+class IssueMoveForm(Form):
+    column_id = IntegerField('column_id')
+    before = IntegerField('before')
+    after = IntegerField('after')
+
+
+@compiled
 class TagCreateForm(ModelForm):
     class Meta:
         model = Tag
 
+@compiled
 class MilestoneCreateForm(ModelForm):
     name = StringField('name')
     description = StringField('description')
     due_date = DateTimeField('due_date', format='%Y-%m-%d %H:%M')
     status = StringField('status')
 
+@compiled
 class EffortCreateForm(ModelForm):
     class Meta:
         model = Effort
 
 
+@compiled
 class ColumnCreateForm(ModelForm):
     class Meta:
-        model = Column
\ No newline at end of file
+        model = Column
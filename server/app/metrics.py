@@ -0,0 +1,302 @@
+import atexit
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import OrderedDict
+from functools import partial, wraps
+
+from flask import request
+from sqlalchemy import event
+
+from app.server import app, db
+
+# Time series for GET /metrics in the Prometheus text format. Recording
+# takes one lock and a dict lookup; histograms keep per-bucket counts that
+# are only made cumulative when rendered. Routes are labelled with the rule
+# they were registered under in app/views.py, so ids never become labels.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000)
+BCRYPT_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+WAIT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+# name -> (type, help, buckets of a histogram)
+METRICS = OrderedDict([
+    ('tagmatic_http_requests_total', ('counter', 'Requests by route, method and status.', None)),
+    ('tagmatic_http_request_errors_total', ('counter', 'Requests that ended in a 5xx or an exception.', None)),
+    ('tagmatic_http_request_duration_seconds',
+     ('histogram', 'Time from the start of a request to its last byte.', LATENCY_BUCKETS)),
+    ('tagmatic_http_response_size_bytes', ('histogram', 'Size of the response bodies that are not streamed.',
+                                           SIZE_BUCKETS)),
+    ('tagmatic_http_requests_in_flight', ('gauge', 'Requests being handled or streamed.', None)),
+    ('tagmatic_bcrypt_seconds', ('histogram', 'Time spent hashing and checking passwords, queueing included.',
+                                 BCRYPT_BUCKETS)),
+    ('tagmatic_bcrypt_shed_total', ('counter', 'Password hashes refused because the bcrypt pool was full.', None)),
+    ('tagmatic_db_pool_checkout_seconds', ('histogram', 'Wait for a connection from the database pool.',
+                                           WAIT_BUCKETS)),
+    ('tagmatic_db_pool_checked_out', ('gauge', 'Database connections in use.', None)),
+    ('tagmatic_cache_requests_total', ('counter', 'Cache lookups by result; the hit ratio is hit / (hit + miss).',
+                                       None)),
+])
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class Registry(object):
+    # the values of this worker process, keyed by (name, labels)
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = {}
+        self.pid = os.getpid()
+
+    def ensure_process(self):
+        # a forked worker starts from zero rather than the parent's copy
+        if self.pid != os.getpid():
+            with self.lock:
+                self.values = {}
+            self.pid = os.getpid()
+            self.started()
+
+    def started(self):
+        pass
+
+    def add(self, name, labels, amount=1):
+        key = (name, labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def observe(self, name, labels, value):
+        buckets = METRICS[name][2]
+        key = (name, labels)
+        with self.lock:
+            entry = self.values.get(key)
+            if entry is None:
+                # one count per bucket and +Inf, then the sum and the count
+                entry = self.values[key] = [0] * (len(buckets) + 3)
+            entry[bisect_left(buckets, value)] += 1
+            entry[-2] += value
+            entry[-1] += 1
+
+    def snapshot(self):
+        with self.lock:
+            return dict((key, list(value) if isinstance(value, list) else value)
+                        for key, value in self.values.items())
+
+    def samples(self):
+        return self.snapshot()
+
+
+class FileRegistry(Registry):
+    # Every worker process writes its values to <path>/<pid>.json each
+    # interval and a scrape adds up all the files, so whichever worker
+    # answers reports the whole host. Files of exited workers keep counting
+    # (counters never go down) except for their gauges; clear the directory
+    # when the server starts.
+
+    def __init__(self, path, interval):
+        Registry.__init__(self)
+        self.path = path
+        self.interval = interval
+        self.flusher_pid = None
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        atexit.register(self.flush)
+
+    def started(self):
+        if self.flusher_pid != os.getpid():
+            self.flusher_pid = os.getpid()
+            flusher = threading.Thread(target=self.flush_forever)
+            flusher.daemon = True
+            flusher.start()
+
+    def flush_forever(self):
+        while True:
+            time.sleep(self.interval)
+            self.flush()
+
+    def file_name(self, pid):
+        return os.path.join(self.path, '%d.json' % pid)
+
+    def flush(self):
+        values = [[name, list(labels), value] for (name, labels), value in self.snapshot().items()]
+        temporary = self.file_name(os.getpid()) + '.tmp'
+        with open(temporary, 'w') as out:
+            json.dump(values, out)
+        os.replace(temporary, self.file_name(os.getpid()))
+
+    def samples(self):
+        samples = self.snapshot()
+        for entry in os.listdir(self.path):
+            if not entry.endswith('.json') or entry == '%d.json' % os.getpid():
+                continue
+            pid = int(entry[:-len('.json')])
+            try:
+                with open(os.path.join(self.path, entry)) as source:
+                    values = json.load(source)
+            except (OSError, ValueError):
+                continue
+            alive = process_alive(pid)
+            for name, labels, value in values:
+                if METRICS.get(name, ('gauge',))[0] == 'gauge' and not alive:
+                    continue
+                merge(samples, (name, tuple(tuple(label) for label in labels)), value)
+        return samples
+
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass
+    return True
+
+
+def merge(samples, key, value):
+    current = samples.get(key)
+    if current is None:
+        samples[key] = value
+    elif isinstance(current, list):
+        samples[key] = [a + b for a, b in zip(current, value)]
+    else:
+        samples[key] = current + value
+
+
+def make_registry(config):
+    backend = config['METRICS']
+    if backend == 'memory':
+        return Registry()
+    if backend == 'file':
+        return FileRegistry(config['METRICS_PATH'], config['METRICS_INTERVAL'])
+    return None
+
+
+registry = make_registry(app.config)
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(value)
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (key, str(value).replace('\\', '\\\\').replace('"', '\\"')
+                                          .replace('\n', '\\n')) for key, value in labels)
+
+
+def render(samples):
+    lines = []
+    for name, (kind, help, buckets) in METRICS.items():
+        lines.append('# HELP %s %s' % (name, help))
+        lines.append('# TYPE %s %s' % (name, kind))
+        for (metric, labels), value in sorted(samples.items()):
+            if metric != name:
+                continue
+            if kind != 'histogram':
+                lines.append('%s%s %s' % (name, format_labels(labels), format_value(value)))
+                continue
+            total = 0
+            for bound, count in zip(buckets + (float('inf'),), value):
+                total += count
+                lines.append('%s_bucket%s %d' % (name, format_labels(labels + (('le', format_value(float(bound))),)),
+                                                 total))
+            lines.append('%s_sum%s %s' % (name, format_labels(labels), format_value(value[-2])))
+            lines.append('%s_count%s %d' % (name, format_labels(labels), value[-1]))
+    return '\n'.join(lines) + '\n'
+
+
+def add(name, labels, amount=1):
+    if registry is not None:
+        registry.add(name, labels, amount)
+
+
+def observe(name, labels, value):
+    if registry is not None:
+        registry.observe(name, labels, value)
+
+
+def count_cache(cache, hit):
+    add('tagmatic_cache_requests_total', (('cache', cache), ('result', 'hit' if hit else 'miss')))
+
+
+def timed(name, labels, f):
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return f(*args, **kwargs)
+        finally:
+            registry.observe(name, labels, time.perf_counter() - started)
+    return wrapper
+
+
+def instrument_engine(engine, name):
+    labels = (('engine', name),)
+    # the pool has no event before a checkout, so its private getter is timed
+    engine.pool._do_get = timed('tagmatic_db_pool_checkout_seconds', labels, engine.pool._do_get)
+
+    @event.listens_for(engine, 'checkout')
+    def checked_out(dbapi_connection, connection_record, connection_proxy):
+        registry.add('tagmatic_db_pool_checked_out', labels)
+
+    @event.listens_for(engine, 'checkin')
+    def checked_in(dbapi_connection, connection_record):
+        registry.add('tagmatic_db_pool_checked_out', labels, -1)
+
+
+if registry is not None:
+    instrument_engine(db.engine, 'primary')
+    if db.replica is not None:
+        instrument_engine(db.replica, 'replica')
+    registry.started()
+
+    # kept in the WSGI environ rather than g, which the in-process
+    # sub-requests of app/batch.py share with their batch
+    @app.before_request
+    def start_request():
+        registry.ensure_process()
+        request.environ['tagmatic.metrics_started'] = time.perf_counter()
+        registry.add('tagmatic_http_requests_in_flight', ())
+
+    def finish(started, route, method, status, size):
+        route_labels = (('route', route), ('method', method))
+        registry.add('tagmatic_http_requests_in_flight', (), -1)
+        registry.add('tagmatic_http_requests_total', route_labels + (('status', str(status)),))
+        if status >= 500:
+            registry.add('tagmatic_http_request_errors_total', route_labels)
+        registry.observe('tagmatic_http_request_duration_seconds', route_labels, time.perf_counter() - started)
+        if size is not None:
+            registry.observe('tagmatic_http_response_size_bytes', (('route', route),), size)
+
+    def current_route():
+        return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+    @app.after_request
+    def measure_response(response):
+        started = request.environ.get('tagmatic.metrics_started')
+        if started is not None and response.is_streamed:
+            # the teardown runs before the body is sent, and an event stream
+            # is sent for as long as the client stays; it is finished once
+            # the server closes the body
+            request.environ['tagmatic.metrics_started'] = None
+            response.call_on_close(partial(finish, started, current_route(), request.method,
+                                           response.status_code, None))
+            return response
+        request.environ['tagmatic.metrics_status'] = response.status_code
+        request.environ['tagmatic.metrics_size'] = response.calculate_content_length()
+        return response
+
+    @app.teardown_request
+    def finish_request(exc):
+        started = request.environ.get('tagmatic.metrics_started')
+        if started is None:
+            return
+        status = request.environ.get('tagmatic.metrics_status', 500) if exc is None else 500
+        finish(started, current_route(), request.method, status, request.environ.get('tagmatic.metrics_size'))
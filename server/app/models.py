@@ -2,7 +2,8 @@ from flask import g
 
 from wtforms.validators import Email
 
-from app.server import db, flask_bcrypt
+from app.server import db
+from app.passwords import generate_password_hash
 
 
 class User(db.Model):
@@ -13,7 +14,7 @@ class User(db.Model):
 
     def __init__(self, email, password):
         self.email = email
-        self.password = flask_bcrypt.generate_password_hash(password)
+        self.password = generate_password_hash(password)
 
     def __repr__(self):
         return '<User %r>' % self.email
@@ -23,8 +24,9 @@ class Post(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(120), nullable=False)
     body = db.Column(db.Text, nullable=False)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), index=True)
     created_at = db.Column(db.DateTime, default=db.func.now())
+    updated_at = db.Column(db.DateTime, default=db.func.now(), onupdate=db.func.now(), index=True)
 
     def __init__(self, title, body):
         self.title = title
@@ -41,6 +43,7 @@ class ToDo(db.Model):
     is_complete = db.Column(db.Boolean, nullable=False, default=False)
     status = db.Column(db.String(120), nullable=False, default='Active')
     created_at = db.Column(db.DateTime, default=db.func.now())
+    updated_at = db.Column(db.DateTime, default=db.func.now(), onupdate=db.func.now(), index=True)
 
     def __init__(self, text, is_complete, status):
         self.text = text
@@ -59,6 +62,7 @@ class Contact(db.Model):
     icon_url = db.Column(db.String(120), nullable=True)
     is_selected = db.Column(db.Boolean, nullable=False, default=False)
     created_at = db.Column(db.DateTime, default=db.func.now())
+    updated_at = db.Column(db.DateTime, default=db.func.now(), onupdate=db.func.now(), index=True)
 
     def __init__(self, text, first_name, last_name, is_selected):
         self.text = text
@@ -73,10 +77,11 @@ class Contact(db.Model):
 class Project(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user = db.relationship('Contact', backref='project')
-    user_id = db.Column(db.Integer, db.ForeignKey('contact.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('contact.id'), nullable=False, index=True)
     name = db.Column(db.String(120), nullable=False)
     description = db.Column(db.Text, nullable=True)
     created_at = db.Column(db.DateTime, default=db.func.now())
+    updated_at = db.Column(db.DateTime, default=db.func.now(), onupdate=db.func.now(), index=True)
 
     def __init__(self, name, description, user_id):
         self.name = name
@@ -87,23 +92,48 @@ class Project(db.Model):
         return '<Project %r>' % self.name
 
 
+# gap between the positions of issues appended to a column, see app/positions.py
+POSITION_GAP = 1024.0
+
+
+def append_position(context):
+    # Issue.position default: after the last issue in the column. Rows
+    # inserted by one executemany are spaced out from each other too.
+    column_id = context.current_parameters.get('column_id')
+    last = context.__dict__.setdefault('last_positions', {})
+    if column_id not in last:
+        table = Issue.__table__
+        last[column_id] = context.connection.execute(
+            db.select([db.func.max(table.c.position)]).where(table.c.column_id == column_id)).scalar() or 0.0
+    last[column_id] += POSITION_GAP
+    return last[column_id]
+
+
 class Issue(db.Model):
+    __table_args__ = (
+        db.Index('ix_issue_project_id_column_id', 'project_id', 'column_id'),
+        db.Index('ix_issue_created_at_id', 'created_at', 'id'),
+        db.Index('ix_issue_column_id_position', 'column_id', 'position'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     project = db.relationship('Project', backref='issue')
     project_id = db.Column(db.Integer, db.ForeignKey('project.id'), nullable=False)
     tag = db.relationship('Tag', backref='issue')
-    tag_id = db.Column(db.Integer, db.ForeignKey('tag.id'), nullable=True)
+    tag_id = db.Column(db.Integer, db.ForeignKey('tag.id'), nullable=True, index=True)
     milestone = db.relationship('Milestone', backref='issue')
-    milestone_id = db.Column(db.Integer, db.ForeignKey('milestone.id'), nullable=True)
+    milestone_id = db.Column(db.Integer, db.ForeignKey('milestone.id'), nullable=True, index=True)
     effort = db.relationship('Effort', backref='issue')
-    effort_id = db.Column(db.Integer, db.ForeignKey('effort.id'), nullable=True)
+    effort_id = db.Column(db.Integer, db.ForeignKey('effort.id'), nullable=True, index=True)
     assigned_to = db.relationship('Contact', backref='issue')
-    assigned_to_id = db.Column(db.Integer, db.ForeignKey('contact.id'), nullable=True)
-    column_id = db.Column(db.Integer, db.ForeignKey('column.id'), nullable=False, default=1)
-    column = db.relationship('Column', backref='tasks')
+    assigned_to_id = db.Column(db.Integer, db.ForeignKey('contact.id'), nullable=True, index=True)
+    column_id = db.Column(db.Integer, db.ForeignKey('column.id'), nullable=False, default=1, index=True)
+    column = db.relationship('Column', backref=db.backref('tasks', order_by='[Issue.position, Issue.id]'))
+    position = db.Column(db.Float, nullable=True, default=append_position)
     title = db.Column(db.String(120), nullable=False)
     description = db.Column(db.Text, nullable=True)
     created_at = db.Column(db.DateTime, default=db.func.now())
+    updated_at = db.Column(db.DateTime, default=db.func.now(), onupdate=db.func.now(), index=True)
 
     def __init__(self, title, description, project_id, column_id, tag_id, milestone_id, effort_id, assigned_to_id):
         self.title = title
@@ -124,6 +154,7 @@ class Tag(db.Model):
     name = db.Column(db.String(120), nullable=False)
     description = db.Column(db.Text, nullable=True)
     color = db.Column(db.String(32), nullable=False, default="ffffff")
+    updated_at = db.Column(db.DateTime, default=db.func.now(), onupdate=db.func.now(), index=True)
 
     def __init__(self, name, description, color):
         self.name = name
@@ -139,6 +170,7 @@ class Milestone(db.Model):
     description = db.Column(db.Text, nullable=True)
     due_date = db.Column(db.DateTime, default=db.func.now())
     status = db.Column(db.String(120), nullable=False, default='Active')
+    updated_at = db.Column(db.DateTime, default=db.func.now(), onupdate=db.func.now(), index=True)
 
     def __init__(self, name, description, due_date, status):
         self.name = name
@@ -153,6 +185,7 @@ class Effort(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(120), nullable=False)
     description = db.Column(db.Text, nullable=True)
+    updated_at = db.Column(db.DateTime, default=db.func.now(), onupdate=db.func.now(), index=True)
 
     def __init__(self, name, description):
         self.name = name
@@ -166,6 +199,7 @@ class Column(db.Model):
     name = db.Column(db.String(120), nullable=False)
     description = db.Column(db.Text, nullable=True)
     created_at = db.Column(db.DateTime, default=db.func.now())
+    updated_at = db.Column(db.DateTime, default=db.func.now(), onupdate=db.func.now(), index=True)
 
     def __init__(self, name, description):
         self.name = name
@@ -174,3 +208,42 @@ class Column(db.Model):
     def __repr__(self):
         return '<Column %r>' % self.name
 
+
+class TableVersion(db.Model):
+    name = db.Column(db.String(64), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+    def __init__(self, name, version=0):
+        self.name = name
+        self.version = version
+
+    def __repr__(self):
+        return '<TableVersion %r>' % self.name
+
+
+class IssueCount(db.Model):
+    # issues per project, column and tag/milestone/effort/assignee value
+    # (0 for none); kept up to date by triggers on issue, see app/stats.py
+    project_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    dimension = db.Column(db.String(16), primary_key=True)
+    value = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    column_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return '<IssueCount %r %r=%r>' % (self.project_id, self.dimension, self.value)
+
+
+class Tombstone(db.Model):
+    # rows deleted from the tables served with ?since= delta sync
+    __table_args__ = (
+        db.Index('ix_tombstone_table_name_deleted_at', 'table_name', 'deleted_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    table_name = db.Column(db.String(64), nullable=False)
+    row_id = db.Column(db.Integer, nullable=False)
+    deleted_at = db.Column(db.DateTime, default=db.func.now())
+
+    def __repr__(self):
+        return '<Tombstone %s %r>' % (self.table_name, self.row_id)
@@ -0,0 +1,182 @@
+import base64
+import json
+from datetime import datetime
+
+from flask import request, current_app
+from flask.ext.restful import abort
+
+from app.server import db
+from app.filters import column_type, apply_filters, bind_value
+from app import fastpath
+from app.sync import decode_token, next_token, deleted_since
+
+DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+
+def default_order(model):
+    if hasattr(model, 'created_at'):
+        return [(model.created_at, False), (model.id, False)]
+    return [(model.id, False)]
+
+
+def requested_order(model, sorts):
+    # ?sort=-created_at,title; id is always appended as the final tie breaker
+    sort = request.args.get('sort')
+    if not sort:
+        return default_order(model)
+    order = []
+    for name in sort.split(','):
+        name = name.strip()
+        descending = name.startswith('-')
+        name = name.lstrip('-')
+        if name not in sorts:
+            abort(400, message='Cannot sort by %s' % name)
+        order.append((getattr(model, name), descending))
+    if not any(column.key == 'id' for column, descending in order):
+        order.append((model.id, False))
+    return order
+
+
+def encode_cursor(values, direction):
+    values = [v.strftime(DATETIME_FORMAT) if isinstance(v, datetime) else v for v in values]
+    raw = json.dumps({'k': values, 'd': direction, 's': request.args.get('sort', '')}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, order):
+    try:
+        raw = base64.urlsafe_b64decode(str(cursor) + '=' * (-len(cursor) % 4))
+        data = json.loads(raw.decode('utf-8'))
+        values, direction = data['k'], data['d']
+        if len(values) != len(order) or direction not in ('next', 'prev') or \
+                data['s'] != request.args.get('sort', ''):
+            raise ValueError(cursor)
+        for index, (column, descending) in enumerate(order):
+            if isinstance(column_type(column), db.DateTime) and values[index] is not None:
+                values[index] = datetime.strptime(values[index], DATETIME_FORMAT)
+        return values, direction
+    except (TypeError, ValueError, KeyError):
+        abort(400, message='Invalid cursor')
+
+
+def nullable(column):
+    return column.property.columns[0].nullable
+
+
+def order_by(order):
+    # NULLs sort below every value, as on SQLite, whatever the database;
+    # beyond() relies on it
+    clauses = []
+    for column, descending in order:
+        if nullable(column):
+            clauses.append(column.is_(None).asc() if descending else column.is_(None).desc())
+        clauses.append(column.desc() if descending else column.asc())
+    return clauses
+
+
+def beyond(order, values):
+    # rows after values in order; = and < never match NULL, so a nullable
+    # column compares with IS NULL where one side is NULL
+    (column, descending), value = order[0], bind_value(values[0])
+    if value is None:
+        ahead = db.false() if descending else column.isnot(None)
+        same = column.is_(None)
+    else:
+        ahead = column < value if descending else column > value
+        if descending and nullable(column):
+            ahead = db.or_(ahead, column.is_(None))
+        same = column == value
+    if len(order) == 1:
+        return ahead
+    return db.or_(ahead, db.and_(same, beyond(order[1:], values[1:])))
+
+
+def page_limit():
+    limit = request.args.get('limit', type=int)
+    max_size = current_app.config['MAX_PAGE_SIZE']
+    if limit is None:
+        return current_app.config['PAGE_SIZE']
+    if limit < 1:
+        abort(400, message='limit must be a positive integer')
+    return min(limit, max_size)
+
+
+def paginate(model, serializer, query=None, filters=(), sorts=(), extend=None):
+    # flat serializers skip the ORM and marshmallow: rows are fetched as column
+    # tuples and turned into dicts by a function compiled for the serializer;
+    # extend(items), if given, completes the serialized items (app/expand.py)
+    if extend is None:
+        extend = lambda items: items
+    fast = query is None and current_app.config['FAST_SERIALIZERS'] and fastpath.supports(serializer)
+    if query is None:
+        query = model.query
+    query = apply_filters(query, model, filters)
+    order = requested_order(model, sorts)
+    fields = fastpath.columns(model, serializer) if fast else []
+    if 'since' in request.args:
+        return changes(model, serializer, query, fields, extend)
+    if 'limit' not in request.args and 'cursor' not in request.args:
+        if 'sort' in request.args:
+            query = query.order_by(*order_by(order))
+        if fast:
+            preload = getattr(extend, 'preload', None)
+            if preload is not None:
+                preload(query)
+            return fastpath.stream_array(serializer, query.with_entities(*fields), extend)
+        return extend(serializer(query.all(), many=True).data)
+
+    limit = page_limit()
+    cursor = request.args.get('cursor')
+    direction = 'next'
+    if cursor:
+        values, direction = decode_cursor(cursor, order)
+    # walking backwards is the same keyset walk with every direction flipped
+    walk = order if direction == 'next' else [(c, not d) for c, d in order]
+    if cursor:
+        query = query.filter(beyond(walk, values))
+    query = query.order_by(*order_by(walk))
+    if fast:
+        keys = [c.key for c in fields]
+        query = query.with_entities(*(fields + [c for c, d in order if c.key not in keys]))
+        keys += [c.key for c, d in order if c.key not in keys]
+        positions = [keys.index(c.key) for c, d in order]
+    rows = query.limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if direction == 'prev':
+        rows.reverse()
+
+    def key(row):
+        if fast:
+            return [row[position] for position in positions]
+        return [getattr(row, c.key) for c, d in order]
+
+    next_cursor = prev_cursor = None
+    if rows:
+        if has_more or direction == 'prev':
+            next_cursor = encode_cursor(key(rows[-1]), 'next')
+        if cursor and (has_more or direction == 'next'):
+            prev_cursor = encode_cursor(key(rows[0]), 'prev')
+
+    return {
+        'items': extend(fastpath.serialize_rows(serializer, rows) if fast else serializer(rows, many=True).data),
+        'next_cursor': next_cursor,
+        'prev_cursor': prev_cursor,
+    }
+
+
+def changes(model, serializer, query, fields, extend):
+    since = decode_token(request.args['since'])
+    token = next_token(since)
+    if since is not None:
+        query = query.filter(model.updated_at >= bind_value(since))
+    query = query.order_by(model.updated_at, model.id)
+    if fields:
+        items = fastpath.serialize_rows(serializer, query.with_entities(*fields).all())
+    else:
+        items = serializer(query.all(), many=True).data
+    items = extend(items)
+    # SQLite can hand a deleted id to a new row; if it exists now it isn't deleted
+    current = set(item['id'] for item in items)
+    deleted = [id for id in deleted_since(model, since) if id not in current]
+    return {'items': items, 'deleted': deleted, 'token': token}
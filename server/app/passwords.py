@@ -0,0 +1,77 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from flask.ext.restful import abort
+
+from app.server import app, db
+from app.auth import hash_password, check_password, hash_cost
+from app.metrics import add, observe
+
+# bcrypt runs on a small pool instead of the request thread, so a burst of
+# sign-ups or logins queues for the pool rather than holding every request
+# thread of the worker. At most BCRYPT_WORKERS + BCRYPT_QUEUE_SIZE hashes are
+# in flight per worker process; past that the request is refused with a 503,
+# which keeps the wait of the accepted ones bounded.
+
+
+class HashPool(object):
+    def __init__(self, kind, workers, queue_size):
+        self.kind = kind
+        self.workers = workers
+        self.slots = threading.BoundedSemaphore(workers + queue_size)
+        self.executor = None
+        self.pid = None
+        self.lock = threading.Lock()
+
+    def pool(self):
+        # started in the worker process that uses it, after any fork
+        with self.lock:
+            if self.pid != os.getpid():
+                executor_class = ProcessPoolExecutor if self.kind == 'process' else ThreadPoolExecutor
+                self.executor, self.pid = executor_class(self.workers), os.getpid()
+            return self.executor
+
+    def run(self, operation, f, args, required=True):
+        # None when the pool is full and the result is not required
+        labels = (('operation', operation),)
+        if self.kind == 'none':
+            return f(*args)
+        if not self.slots.acquire(False):
+            add('tagmatic_bcrypt_shed_total', labels)
+            if not required:
+                return None
+            abort(503, message='Too many password checks at once, try again shortly')
+        started = time.perf_counter()
+        try:
+            return self.pool().submit(f, *args).result()
+        finally:
+            self.slots.release()
+            observe('tagmatic_bcrypt_seconds', labels, time.perf_counter() - started)
+
+
+hash_pool = HashPool(app.config['BCRYPT_POOL'], app.config['BCRYPT_WORKERS'], app.config['BCRYPT_QUEUE_SIZE'])
+
+
+def generate_password_hash(password):
+    return hash_pool.run('hash', hash_password, (password, app.config['BCRYPT_LOG_ROUNDS']))
+
+
+def check_password_hash(pw_hash, password):
+    return hash_pool.run('check', check_password, (password, pw_hash))
+
+
+def verify_user(user, password):
+    # A successful check also upgrades a hash of another cost, as only now
+    # is the password known. That is skipped while the pool is busy; the
+    # next login will try again.
+    if not check_password_hash(user.password, password):
+        return False
+    rounds = app.config['BCRYPT_LOG_ROUNDS']
+    if hash_cost(user.password) != rounds:
+        pw_hash = hash_pool.run('hash', hash_password, (password, rounds), required=False)
+        if pw_hash is not None:
+            user.password = pw_hash
+            db.session.commit()
+    return True
@@ -0,0 +1,66 @@
+from sqlalchemy import bindparam
+
+from app.server import db
+from app.models import Issue, POSITION_GAP
+from app.versions import touch
+from app.events import record_ids
+from app.bulk import chunks
+
+# A move takes the midpoint between the new neighbours' positions, so it
+# only ever writes the moved row. The column is renumbered only once repeated
+# moves into the same gap run out of float precision; every issue of the
+# column is then published as updated, so boards reload their positions.
+
+
+def column_issues(column_id, moved_id):
+    return Issue.query.with_entities(Issue.id, Issue.position) \
+        .filter(Issue.column_id == column_id, Issue.id != moved_id)
+
+
+def neighbours(column_id, moved_id, before=None, after=None):
+    # (lower, upper) positions around the gap the issue is moved into; None
+    # for an open end
+    issues = column_issues(column_id, moved_id)
+    if after is not None:
+        lower = after.position
+        upper = issues.filter(Issue.position > lower).order_by(Issue.position).first()
+        return lower, upper.position if upper else None
+    if before is not None:
+        upper = before.position
+        lower = issues.filter(Issue.position < upper).order_by(Issue.position.desc()).first()
+        return lower.position if lower else None, upper
+    last = issues.order_by(Issue.position.desc()).first()
+    return last.position if last else None, None
+
+
+def between(lower, upper):
+    if lower is None and upper is None:
+        return POSITION_GAP
+    if lower is None:
+        return upper - POSITION_GAP
+    if upper is None:
+        return lower + POSITION_GAP
+    position = (lower + upper) / 2
+    return position if lower < position < upper else None
+
+
+def respace(column_id):
+    ids = [id for id, position in Issue.query.with_entities(Issue.id, Issue.position)
+           .filter(Issue.column_id == column_id).order_by(Issue.position, Issue.id)]
+    if ids:
+        table = Issue.__table__
+        db.session.execute(table.update().where(table.c.id == bindparam('_id')),
+                           [{'_id': id, 'position': (index + 1) * POSITION_GAP} for index, id in enumerate(ids)])
+        touch(db.session, [table.name])
+        for chunk in chunks(ids):
+            record_ids(db.session, Issue, 'updated', chunk)
+        db.session.expire_all()
+
+
+def move_issue(issue, column_id, before=None, after=None):
+    position = between(*neighbours(column_id, issue.id, before, after))
+    if position is None:
+        respace(column_id)
+        position = between(*neighbours(column_id, issue.id, before, after))
+    issue.column_id = column_id
+    issue.position = position
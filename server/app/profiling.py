@@ -0,0 +1,152 @@
+import cProfile
+import logging
+import os
+import random
+import re
+import time
+from contextlib import contextmanager
+
+from flask import g, request, has_app_context
+from sqlalchemy import event
+
+from app.server import app, db, api
+
+# Per-request instrumentation. A sampled request counts and times every SQL
+# statement it runs, the time spent turning results into JSON and its total
+# time. The totals go out in a Server-Timing header; requests slower than
+# SLOW_REQUEST_MS are logged with their statements and, when PROFILE_DUMP_DIR
+# is set, a cProfile dump. Requests that are not sampled cost one random().
+
+logger = logging.getLogger('tagmatic.profiling')
+
+# statements listed in a slow-request log entry
+LOGGED_STATEMENTS = 100
+
+
+class RequestProfile(object):
+    def __init__(self, profiler=None):
+        self.started = time.perf_counter()
+        self.statements = []  # (statement, seconds)
+        self.db_time = 0.0
+        self.serialize_time = 0.0
+        self.serializing = 0
+        self.profiler = profiler
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def server_timing(self):
+        # everything up to the headers; a streamed body is timed in the log only
+        return 'db;dur=%.3f;desc="%d queries", serialize;dur=%.3f, total;dur=%.3f' % (
+            self.db_time * 1000, len(self.statements), self.serialize_time * 1000, self.elapsed() * 1000)
+
+
+def current_profile():
+    return getattr(g, 'profile', None) if has_app_context() else None
+
+
+@contextmanager
+def serializing():
+    # Times marshalling and JSON encoding. Queries run meanwhile (lazy
+    # relationships of nested serializers) count as db time only, and nested
+    # blocks count once.
+    profile = current_profile()
+    if profile is None or profile.serializing:
+        yield
+        return
+    profile.serializing += 1
+    started, db_time = time.perf_counter(), profile.db_time
+    try:
+        yield
+    finally:
+        profile.serializing -= 1
+        profile.serialize_time += time.perf_counter() - started - (profile.db_time - db_time)
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if current_profile() is not None:
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = current_profile()
+    if profile is not None and conn.info.get('query_started'):
+        seconds = time.perf_counter() - conn.info['query_started'].pop()
+        profile.db_time += seconds
+        profile.statements.append((statement, seconds))
+
+
+for engine in (db.engine, db.replica):
+    if engine is not None:
+        event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', after_cursor_execute)
+
+
+def timed_representation(representation):
+    def output(data, code, headers=None):
+        with serializing():
+            return representation(data, code, headers)
+    return output
+
+
+for mediatype, representation in list(api.representations.items()):
+    api.representations[mediatype] = timed_representation(representation)
+
+
+@app.before_request
+def start_profile():
+    if random.random() >= app.config['PROFILE_SAMPLE_RATE']:
+        return
+    profiler = None
+    if app.config['PROFILE_DUMP_DIR']:
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # another profiler is active in this process (python 3.12+)
+            profiler = None
+    g.profile = RequestProfile(profiler)
+
+
+@app.after_request
+def finish_profile(response):
+    profile = current_profile()
+    if profile is None:
+        return response
+    if app.config['PROFILE_HEADER']:
+        response.headers['Server-Timing'] = profile.server_timing()
+        response.headers['Timing-Allow-Origin'] = '*'
+    method, path = request.method, request.full_path.rstrip('?')
+    endpoint = request.endpoint or 'none'
+    # after a streamed body is sent, when the request context is gone
+    response.call_on_close(lambda: log_profile(profile, method, path, endpoint, response.status_code))
+    return response
+
+
+def log_profile(profile, method, path, endpoint, status):
+    elapsed = profile.elapsed()
+    if profile.profiler is not None:
+        profile.profiler.disable()
+    if elapsed * 1000 < app.config['SLOW_REQUEST_MS']:
+        return
+    lines = ['slow request %s %s %d: %.1fms, db %.1fms in %d queries, serialize %.1fms' % (
+        method, path, status, elapsed * 1000, profile.db_time * 1000, len(profile.statements),
+        profile.serialize_time * 1000)]
+    for statement, seconds in profile.statements[:LOGGED_STATEMENTS]:
+        lines.append('  %8.2fms  %s' % (seconds * 1000, ' '.join(statement.split())))
+    if len(profile.statements) > LOGGED_STATEMENTS:
+        lines.append('  ... %d more statements' % (len(profile.statements) - LOGGED_STATEMENTS))
+    if profile.profiler is not None:
+        lines.append('  profile: %s' % dump_profile(profile.profiler, endpoint, elapsed))
+    logger.warning('\n'.join(lines))
+
+
+def dump_profile(profiler, endpoint, elapsed):
+    directory = app.config['PROFILE_DUMP_DIR']
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    name = '%s-%s-%dms-%d.prof' % (time.strftime('%Y%m%d%H%M%S'), re.sub(r'\W+', '_', endpoint),
+                                   elapsed * 1000, os.getpid())
+    path = os.path.join(directory, name)
+    profiler.dump_stats(path)
+    return path
@@ -0,0 +1,110 @@
+import re
+
+from flask.ext.restful import abort
+from markupsafe import escape
+from sqlalchemy import event, text
+
+from app.server import db
+
+# search type -> (content table, indexed columns)
+SEARCH_INDEXES = [
+    ('issue', 'issue', ('title', 'description')),
+    ('post', 'post', ('title', 'body')),
+    ('todo', 'to_do', ('text',)),
+    ('contact', 'contact', ('first_name', 'last_name', 'text')),
+]
+
+# snippet() highlight markers, swapped for <mark> once the snippet is escaped
+MARK_START, MARK_END = '\x02', '\x03'
+
+
+def fts_table(table):
+    return '%s_fts' % table
+
+
+def search_ddl(table, columns):
+    fts = fts_table(table)
+    names = ', '.join(columns)
+    new_values = ', '.join('new.%s' % column for column in columns)
+    old_values = ', '.join('old.%s' % column for column in columns)
+    insert = "INSERT INTO {fts}(rowid, {names}) VALUES (new.id, {new});"
+    delete = "INSERT INTO {fts}({fts}, rowid, {names}) VALUES ('delete', old.id, {old});"
+    statements = [
+        "CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN %s END" % insert,
+        "CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN %s END" % delete,
+        "CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF {names} ON {table} BEGIN %s %s END" % (delete, insert),
+    ]
+    return [s.format(fts=fts, table=table, names=names, new=new_values, old=old_values) for s in statements]
+
+
+def create_search_index(connection):
+    for kind, table, columns in SEARCH_INDEXES:
+        fts = fts_table(table)
+        exists = connection.execute(text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+                                    name=fts).scalar()
+        if not exists:
+            connection.execute("CREATE VIRTUAL TABLE %s USING fts5(%s, content='%s', content_rowid='id')"
+                               % (fts, ', '.join(columns), table))
+            connection.execute("INSERT INTO %s(%s) VALUES ('rebuild')" % (fts, fts))
+        for statement in search_ddl(table, columns):
+            connection.execute(statement)
+
+
+def rebuild_search_index(connection):
+    create_search_index(connection)
+    for kind, table, columns in SEARCH_INDEXES:
+        fts = fts_table(table)
+        connection.execute("INSERT INTO %s(%s) VALUES ('rebuild')" % (fts, fts))
+
+
+@event.listens_for(db.metadata, 'after_create')
+def after_create(target, connection, **kw):
+    if connection.dialect.name == 'sqlite':
+        create_search_index(connection)
+
+
+@event.listens_for(db.metadata, 'before_drop')
+def before_drop(target, connection, **kw):
+    if connection.dialect.name == 'sqlite':
+        for kind, table, columns in SEARCH_INDEXES:
+            connection.execute('DROP TABLE IF EXISTS %s' % fts_table(table))
+
+
+def match_expression(q):
+    # quote every term so user input can't use FTS5 query syntax, and let the
+    # last term match as a prefix for search-as-you-type
+    terms = re.findall(r'\w+', q, re.UNICODE)
+    if not terms:
+        return None
+    quoted = ['"%s"' % term for term in terms]
+    quoted[-1] += '*'
+    return ' '.join(quoted)
+
+
+def search(q, kinds, limit, offset):
+    if db.engine.name != 'sqlite':
+        abort(501, message='Search requires SQLite with FTS5')
+    match = match_expression(q)
+    if match is None:
+        return [], False
+
+    selects = []
+    for kind, table, columns in SEARCH_INDEXES:
+        if kinds and kind not in kinds:
+            continue
+        fts = fts_table(table)
+        selects.append("SELECT '%s' AS type, rowid AS id, bm25(%s) AS score, "
+                       "snippet(%s, -1, :mark_start, :mark_end, '...', 12) AS snippet "
+                       "FROM %s WHERE %s MATCH :match" % (kind, fts, fts, fts, fts))
+    if not selects:
+        return [], False
+    sql = ' UNION ALL '.join(selects) + ' ORDER BY score, type, id LIMIT :limit OFFSET :offset'
+    rows = db.session.execute(text(sql), {'match': match, 'mark_start': MARK_START, 'mark_end': MARK_END,
+                                          'limit': limit + 1, 'offset': offset}).fetchall()
+    hits = [{
+        'type': row.type,
+        'id': row.id,
+        'score': -row.score,
+        'snippet': str(escape(row.snippet)).replace(MARK_START, '<mark>').replace(MARK_END, '</mark>'),
+    } for row in rows[:limit]]
+    return hits, len(rows) > limit
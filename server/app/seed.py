@@ -0,0 +1,162 @@
+import random
+from datetime import datetime, timedelta
+
+from app.server import app
+from app.models import User, Post, ToDo, Contact, Project, Issue, Tag, Milestone, Effort, Column, POSITION_GAP
+from app.bulk import chunks
+from app.transfer import insert_statement, stored_datetime
+from app.auth import hash_password
+from app.versions import touch
+
+# Generated workspace for benchmarks (db_seed.py, benchmark.py). The same
+# seed and scale always give the same rows, so runs on different machines or
+# commits measure the same data.
+
+SCALES = {'1k': 1000, '10k': 10000, '100k': 100000, '1m': 1000000}
+
+# every generated user logs in with this password
+PASSWORD = 'password'
+
+COLUMNS = ['Backlog', 'To Do', 'In Progress', 'Review', 'Done']
+# share of issues per column, most of them waiting or finished
+COLUMN_WEIGHTS = [30, 15, 10, 5, 40]
+TAGS = [('bug', 'e11d48'), ('feature', '2563eb'), ('chore', '64748b'), ('docs', '0d9488'),
+        ('design', 'c026d3'), ('backend', '7c3aed'), ('frontend', 'ea580c'), ('infra', '475569'),
+        ('security', 'dc2626'), ('performance', 'ca8a04'), ('ux', 'db2777'), ('research', '059669')]
+EFFORTS = ['XS', 'S', 'M', 'L', 'XL']
+FIRST_NAMES = ['Ana', 'Ivan', 'Marta', 'Luka', 'Petra', 'Marko', 'Sara', 'Josip', 'Ema', 'Tomislav']
+LAST_NAMES = ['Horvat', 'Kovac', 'Babic', 'Maric', 'Juric', 'Novak', 'Knezevic', 'Vukovic']
+WORDS = ['login', 'page', 'crash', 'search', 'export', 'board', 'column', 'card', 'drag', 'filter', 'sort',
+         'token', 'cache', 'import', 'milestone', 'sync', 'mobile', 'layout', 'report', 'email', 'upload',
+         'timeout', 'profile', 'settings', 'invite', 'billing', 'chart', 'dashboard', 'api', 'webhook']
+
+# created_at of generated rows is spread over the year before this
+EPOCH = datetime(2026, 1, 1)
+
+
+def parse_scale(value):
+    value = value.lower()
+    return SCALES[value] if value in SCALES else int(value)
+
+
+def sizes(issues):
+    users = max(5, min(issues // 100, 10000))
+    projects = max(1, issues // 500)
+    return {
+        'user': users,
+        'contact': users,
+        'project': projects,
+        'milestone': max(3, min(projects * 2, 5000)),
+        'post': users * 2,
+        'to_do': 50,
+        'issue': issues,
+    }
+
+
+class Generator(object):
+    def __init__(self, seed):
+        self.random = random.Random(seed)
+
+    def words(self, low, high):
+        return ' '.join(self.random.choice(WORDS) for i in range(self.random.randint(low, high)))
+
+    def maybe(self, share, value):
+        return value if self.random.random() < share else None
+
+    def timestamps(self, count):
+        # increasing with the id, like rows created over a year
+        step = timedelta(days=365) / max(count, 1)
+        start = EPOCH - timedelta(days=365)
+        return [stored_datetime((start + step * index).replace(microsecond=0)) for index in range(count)]
+
+
+def insert(session, model, rows):
+    for chunk in chunks(rows):
+        session.execute(insert_statement(model.__table__), chunk)
+    return len(rows)
+
+
+def seed(session, issues, seed=1):
+    # Inserts a workspace with `issues` issues plus proportional users,
+    # contacts, projects, milestones and posts into the current transaction.
+    gen = Generator(seed)
+    size = sizes(issues)
+    counts = {}
+    # one bcrypt hash for everyone; hashing per user would dominate seeding
+    password = hash_password(PASSWORD, app.config['BCRYPT_LOG_ROUNDS'])
+
+    counts['user'] = insert(session, User, [
+        {'id': id, 'email': 'user%d@example.com' % id, 'password': password}
+        for id in range(1, size['user'] + 1)])
+
+    stamps = gen.timestamps(size['contact'])
+    counts['contact'] = insert(session, Contact, [
+        {'id': id, 'first_name': gen.random.choice(FIRST_NAMES), 'last_name': gen.random.choice(LAST_NAMES),
+         'text': gen.words(3, 8), 'icon_url': None, 'is_selected': False,
+         'created_at': stamps[id - 1], 'updated_at': stamps[id - 1]}
+        for id in range(1, size['contact'] + 1)])
+
+    stamp = stored_datetime(EPOCH - timedelta(days=365))
+    counts['column'] = insert(session, Column, [
+        {'id': index + 1, 'name': name, 'description': '', 'created_at': stamp, 'updated_at': stamp}
+        for index, name in enumerate(COLUMNS)])
+    counts['tag'] = insert(session, Tag, [
+        {'id': index + 1, 'name': name, 'description': 'Issues about %s' % name, 'color': color, 'updated_at': stamp}
+        for index, (name, color) in enumerate(TAGS)])
+    counts['effort'] = insert(session, Effort, [
+        {'id': index + 1, 'name': name, 'description': '', 'updated_at': stamp} for index, name in enumerate(EFFORTS)])
+
+    counts['milestone'] = insert(session, Milestone, [
+        {'id': id, 'name': 'Release %d' % id, 'description': gen.words(2, 6),
+         'due_date': stored_datetime(EPOCH + timedelta(days=14 * id)),
+         'status': 'Completed' if id * 3 < size['milestone'] else 'Active', 'updated_at': stamp}
+        for id in range(1, size['milestone'] + 1)])
+
+    stamps = gen.timestamps(size['project'])
+    counts['project'] = insert(session, Project, [
+        {'id': id, 'user_id': gen.random.randint(1, size['contact']), 'name': 'Project %s' % gen.words(1, 2),
+         'description': gen.words(5, 15), 'created_at': stamps[id - 1], 'updated_at': stamps[id - 1]}
+        for id in range(1, size['project'] + 1)])
+
+    stamps = gen.timestamps(size['post'])
+    counts['post'] = insert(session, Post, [
+        {'id': id, 'user_id': gen.random.randint(1, size['user']), 'title': gen.words(2, 5).capitalize(),
+         'body': gen.words(20, 60), 'created_at': stamps[id - 1], 'updated_at': stamps[id - 1]}
+        for id in range(1, size['post'] + 1)])
+
+    stamps = gen.timestamps(size['to_do'])
+    counts['to_do'] = insert(session, ToDo, [
+        {'id': id, 'text': gen.words(3, 8), 'is_complete': id % 3 == 0, 'status': 'Completed' if id % 3 == 0 else 'Active',
+         'created_at': stamps[id - 1], 'updated_at': stamps[id - 1]}
+        for id in range(1, size['to_do'] + 1)])
+
+    # issues are generated chunk by chunk so 1m of them never sit in memory
+    stamps = gen.timestamps(issues)
+    column_ids = list(range(1, len(COLUMNS) + 1))
+    # positions are set here rather than by append_position, which would look
+    # up the end of every column once per chunk
+    positions = dict((id, 0.0) for id in column_ids)
+    for ids in chunks(range(1, issues + 1)):
+        rows = []
+        for id in ids:
+            column_id = gen.random.choices(column_ids, COLUMN_WEIGHTS)[0]
+            positions[column_id] += POSITION_GAP
+            rows.append({
+                'id': id,
+                'project_id': gen.random.randint(1, size['project']),
+                'column_id': column_id,
+                'position': positions[column_id],
+                'tag_id': gen.maybe(0.7, gen.random.randint(1, len(TAGS))),
+                'milestone_id': gen.maybe(0.5, gen.random.randint(1, size['milestone'])),
+                'effort_id': gen.maybe(0.6, gen.random.randint(1, len(EFFORTS))),
+                'assigned_to_id': gen.maybe(0.8, gen.random.randint(1, size['contact'])),
+                'title': gen.words(3, 7).capitalize(),
+                'description': gen.words(10, 40),
+                'created_at': stamps[id - 1],
+                'updated_at': stamps[id - 1],
+            })
+        session.execute(insert_statement(Issue.__table__), rows)
+    counts['issue'] = issues
+
+    touch(session, counts.keys())
+    return counts
@@ -1,4 +1,13 @@
-from marshmallow import Serializer, fields
+from marshmallow import Serializer as BaseSerializer, fields
+
+from app.profiling import serializing
+
+
+class Serializer(BaseSerializer):
+    # marshmallow marshals in the constructor; time it as serialization
+    def __init__(self, *args, **kwargs):
+        with serializing():
+            BaseSerializer.__init__(self, *args, **kwargs)
 
 
 class UserSerializer(Serializer):
@@ -3,27 +3,29 @@ import os
 from flask import Flask
 from flask.ext import restful
 from flask.ext.restful import reqparse, Api
-from flask.ext.sqlalchemy import SQLAlchemy
-from flask.ext.bcrypt import Bcrypt
-from flask.ext.httpauth import HTTPBasicAuth
+
+from app.auth import HTTPTokenAuth
+from app.storage import Database, database_url, tune_engine, replica_engine, guard_fork
+from app.factory import configure, chosen
 
 basedir = os.path.join(os.path.abspath(os.path.dirname(__file__)), '../')
  
 app = Flask(__name__)
-app.config.from_object('app.config')
+# the profile and settings given to create_app() (app/factory.py)
+configure(app.config, chosen['profile'], chosen['settings'])
  
 # flask-sqlalchemy
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(basedir, 'app.sqlite')
-db = SQLAlchemy(app)
+app.config['SQLALCHEMY_DATABASE_URI'] = database_url(app.config, basedir)
+db = Database(app)
+tune_engine(db.engine, app.config)
+guard_fork(db.engine)
+db.replica = replica_engine(app.config)
  
 # flask-restful
 api = restful.Api(app)
  
-# flask-bcrypt
-flask_bcrypt = Bcrypt(app)
- 
 # flask-httpauth
-auth = HTTPBasicAuth()
+auth = HTTPTokenAuth()
  
 @app.after_request
 def after_request(response):
@@ -33,4 +35,4 @@ def after_request(response):
     response.headers.add('Allow', 'PUT,PATCH,DELETE')
     return response
  
-from app import views
+from app import views, compression
@@ -0,0 +1,125 @@
+from collections import defaultdict
+
+from sqlalchemy import event, text
+
+from app.server import app, db
+from app.models import Issue, IssueCount, Column
+
+# breakdown name -> (issue_count.dimension, issue column)
+DIMENSIONS = [
+    ('tags', 'tag', 'tag_id'),
+    ('milestones', 'milestone', 'milestone_id'),
+    ('efforts', 'effort', 'effort_id'),
+    ('assignees', 'assignee', 'assigned_to_id'),
+]
+
+COUNTED_COLUMNS = ('project_id', 'column_id') + tuple(column for name, dimension, column in DIMENSIONS)
+TRIGGERS = ('issue_count_ai', 'issue_count_ad', 'issue_count_au')
+
+
+def counter_sql(row, delta):
+    statements = []
+    for name, dimension, column in DIMENSIONS:
+        values = dict(row=row, dimension=dimension, column=column, delta=delta)
+        if delta > 0:
+            statements.append("INSERT OR IGNORE INTO issue_count (project_id, dimension, value, column_id, count) "
+                              "VALUES ({row}.project_id, '{dimension}', coalesce({row}.{column}, 0), "
+                              "{row}.column_id, 0);".format(**values))
+        statements.append("UPDATE issue_count SET count = count + ({delta}) WHERE project_id = {row}.project_id "
+                          "AND dimension = '{dimension}' AND value = coalesce({row}.{column}, 0) "
+                          "AND column_id = {row}.column_id;".format(**values))
+    return ' '.join(statements)
+
+
+def counter_ddl():
+    return [
+        "CREATE TRIGGER IF NOT EXISTS issue_count_ai AFTER INSERT ON issue BEGIN %s END" % counter_sql('new', 1),
+        "CREATE TRIGGER IF NOT EXISTS issue_count_ad AFTER DELETE ON issue BEGIN %s END" % counter_sql('old', -1),
+        "CREATE TRIGGER IF NOT EXISTS issue_count_au AFTER UPDATE OF %s ON issue BEGIN %s %s END"
+        % (', '.join(COUNTED_COLUMNS), counter_sql('old', -1), counter_sql('new', 1)),
+    ]
+
+
+def counters_enabled(connection):
+    return app.config['ISSUE_COUNTERS'] and connection.dialect.name == 'sqlite'
+
+
+def drop_counters(connection):
+    for trigger in TRIGGERS:
+        connection.execute('DROP TRIGGER IF EXISTS %s' % trigger)
+
+
+def rebuild_counters(connection):
+    # Recounts every project from the issue table. The triggers keep the
+    # counts exact from then on, bulk statements and imports included.
+    for statement in counter_ddl():
+        connection.execute(statement)
+    connection.execute('DELETE FROM issue_count')
+    for name, dimension, column in DIMENSIONS:
+        connection.execute("INSERT INTO issue_count (project_id, dimension, value, column_id, count) "
+                           "SELECT project_id, '%s', coalesce(%s, 0), column_id, count(*) FROM issue "
+                           "GROUP BY project_id, coalesce(%s, 0), column_id" % (dimension, column, column))
+
+
+@event.listens_for(db.metadata, 'after_create')
+def after_create(target, connection, tables=(), **kw):
+    if not counters_enabled(connection):
+        return
+    if IssueCount.__table__ in tables:
+        rebuild_counters(connection)
+    else:
+        for statement in counter_ddl():
+            connection.execute(statement)
+
+
+def issue_groups(project_id):
+    # (dimension, value, column_id, count) rows, from the counters when they
+    # are kept and straight from the issue table otherwise
+    if counters_enabled(db.session.connection()):
+        return db.session.query(IssueCount.dimension, IssueCount.value, IssueCount.column_id, IssueCount.count) \
+            .filter(IssueCount.project_id == project_id, IssueCount.count > 0).all()
+    rows = []
+    for name, dimension, column in DIMENSIONS:
+        value = db.func.coalesce(getattr(Issue, column), 0)
+        rows.extend(db.session.query(db.literal(dimension), value, Issue.column_id, db.func.count(Issue.id))
+                    .filter(Issue.project_id == project_id)
+                    .group_by(value, Issue.column_id).all())
+    return rows
+
+
+def done_column_ids():
+    names = [name.lower() for name in app.config['DONE_COLUMNS']]
+    return set(id for id, name in db.session.query(Column.id, Column.name) if name.lower() in names)
+
+
+def breakdown(counts, done=None):
+    items = []
+    for value in sorted(counts):
+        item = {'id': value or None, 'count': counts[value]}
+        if done is not None:
+            item['done'] = done[value]
+            item['completion'] = round(100.0 * done[value] / counts[value], 1)
+        items.append(item)
+    return items
+
+
+def project_stats(project_id, done_columns):
+    counts = dict((dimension, defaultdict(int)) for name, dimension, column in DIMENSIONS)
+    columns = defaultdict(int)
+    done = defaultdict(int)
+    for dimension, value, column_id, count in issue_groups(project_id):
+        counts[dimension][value] += count
+        if dimension == 'tag':
+            # every issue is counted once per dimension; any one gives the columns
+            columns[column_id] += count
+        if dimension == 'milestone' and column_id in done_columns:
+            done[value] += count
+
+    stats = {
+        'project_id': project_id,
+        'total': sum(columns.values()),
+        'columns': breakdown(columns),
+    }
+    for name, dimension, column in DIMENSIONS:
+        stats[name] = breakdown(counts[dimension], done if dimension == 'milestone' else None)
+    return stats
@@ -0,0 +1,118 @@
+import os
+from functools import partial
+
+from flask import request, has_request_context
+from flask.ext.sqlalchemy import SQLAlchemy
+from sqlalchemy import create_engine, event, exc, orm
+from sqlalchemy.engine.url import make_url
+
+try:
+    from flask.ext.sqlalchemy import SignallingSession
+except ImportError:
+    from flask.ext.sqlalchemy import _SignallingSession as SignallingSession
+
+# config key -> create_engine() argument, only used for server databases
+POOL_OPTIONS = [
+    ('DATABASE_POOL_SIZE', 'pool_size'),
+    ('DATABASE_MAX_OVERFLOW', 'max_overflow'),
+    ('DATABASE_POOL_TIMEOUT', 'pool_timeout'),
+    ('DATABASE_POOL_RECYCLE', 'pool_recycle'),
+]
+
+READ_METHODS = ('GET', 'HEAD')
+
+
+def database_url(config, basedir):
+    return config['DATABASE_URL'] or 'sqlite:///' + os.path.join(basedir, 'app.sqlite')
+
+
+def is_sqlite(url):
+    return make_url(url).drivername.startswith('sqlite')
+
+
+def pool_options(config, url):
+    if is_sqlite(url):
+        return {}
+    return dict((option, config[key]) for key, option in POOL_OPTIONS if config[key] is not None)
+
+
+def sqlite_pragmas(config, read_only=False):
+    # busy_timeout goes first so switching the journal mode waits for locks too
+    pragmas = ['PRAGMA busy_timeout = %d' % config['SQLITE_BUSY_TIMEOUT']]
+    if config['SQLITE_WAL']:
+        # readers no longer block on a writer; NORMAL only syncs at checkpoints
+        pragmas += ['PRAGMA journal_mode = WAL', 'PRAGMA synchronous = NORMAL']
+    if config['SQLITE_MMAP_SIZE']:
+        pragmas.append('PRAGMA mmap_size = %d' % config['SQLITE_MMAP_SIZE'])
+    if read_only:
+        pragmas.append('PRAGMA query_only = 1')
+    return pragmas
+
+
+def tune_engine(engine, config, read_only=False):
+    if engine.name != 'sqlite':
+        return
+    pragmas = sqlite_pragmas(config, read_only)
+
+    @event.listens_for(engine, 'connect')
+    def connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma in pragmas:
+            cursor.execute(pragma)
+        cursor.close()
+
+
+def guard_fork(engine):
+    # A pooled connection opened before a fork is not used by the child: it
+    # is dropped on checkout and the pool connects again in the child.
+    @event.listens_for(engine, 'connect')
+    def connect(dbapi_connection, connection_record):
+        connection_record.info['pid'] = os.getpid()
+
+    @event.listens_for(engine, 'checkout')
+    def checkout(dbapi_connection, connection_record, connection_proxy):
+        if connection_record.info['pid'] != os.getpid():
+            connection_record.connection = connection_proxy.connection = None
+            raise exc.DisconnectionError('connection opened by process %d, checked out by %d' % (
+                connection_record.info['pid'], os.getpid()))
+
+
+def replica_engine(config):
+    url = config['DATABASE_REPLICA_URL']
+    if not url:
+        return None
+    engine = create_engine(url, **pool_options(config, url))
+    tune_engine(engine, config, read_only=True)
+    guard_fork(engine)
+    return engine
+
+
+def reads_replica():
+    return has_request_context() and request.method in READ_METHODS
+
+
+class RoutingSession(SignallingSession):
+    # Sends the queries of GET and HEAD requests to the replica, if there is
+    # one. Anything flushed still goes to the primary.
+
+    def __init__(self, db, **options):
+        self.replica = db.replica
+        SignallingSession.__init__(self, db, **options)
+
+    def get_bind(self, mapper=None, clause=None):
+        if self.replica is not None and not self._flushing and reads_replica():
+            return self.replica
+        return SignallingSession.get_bind(self, mapper, clause)
+
+
+class Database(SQLAlchemy):
+    replica = None
+
+    def create_scoped_session(self, options=None):
+        options = dict(options or {})
+        scopefunc = options.pop('scopefunc', None)
+        return orm.scoped_session(partial(RoutingSession, self, **options), scopefunc=scopefunc)
+
+    def apply_driver_hacks(self, app, info, options):
+        SQLAlchemy.apply_driver_hacks(self, app, info, options)
+        options.update(pool_options(app.config, info))
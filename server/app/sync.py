@@ -0,0 +1,80 @@
+import base64
+from datetime import datetime, timedelta
+
+from flask import current_app
+from flask.ext.restful import abort
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app.server import db
+from app.filters import bind_value
+from app.models import Post, ToDo, Contact, Project, Issue, Tag, Milestone, Effort, Column, Tombstone
+
+# Delta sync: every list endpoint accepts ?since=<token> and then returns the
+# rows whose updated_at is at or after the token, the ids deleted since, and
+# the token for the next call. The next token lags the database clock by
+# SYNC_WINDOW seconds, so a row written by a transaction that committed late
+# is sent again rather than missed; clients apply items as upserts.
+
+SYNC_MODELS = [Post, ToDo, Contact, Project, Issue, Tag, Milestone, Effort, Column]
+SYNC_TABLES = set(model.__tablename__ for model in SYNC_MODELS)
+
+TOKEN_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+tombstone_table = Tombstone.__table__
+
+
+def bury(session, table_name, ids):
+    if table_name in SYNC_TABLES and ids:
+        session.execute(tombstone_table.insert(), [{'table_name': table_name, 'row_id': id} for id in ids])
+
+
+@event.listens_for(Session, 'after_flush')
+def bury_flushed(session, flush_context):
+    deleted = {}
+    for obj in session.deleted:
+        deleted.setdefault(obj.__tablename__, []).append(obj.id)
+    for table_name, ids in deleted.items():
+        bury(session, table_name, ids)
+
+
+def encode_token(value):
+    return base64.urlsafe_b64encode(value.strftime(TOKEN_FORMAT).encode('ascii')).decode('ascii').rstrip('=')
+
+
+def decode_token(token):
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(str(token) + '=' * (-len(token) % 4))
+        return datetime.strptime(raw.decode('ascii'), TOKEN_FORMAT)
+    except (TypeError, ValueError):
+        abort(400, message='Invalid since token')
+
+
+def database_now():
+    now = db.session.query(db.func.now()).scalar()
+    if isinstance(now, str):
+        now = datetime.strptime(now, TOKEN_FORMAT)
+    return now.replace(microsecond=0, tzinfo=None)
+
+
+def next_token(since):
+    now = database_now()
+    if since is not None and since < now - timedelta(days=current_app.config['TOMBSTONE_RETENTION']):
+        abort(410, message='since token is older than the tombstone log; fetch the list without it')
+    return encode_token(now - timedelta(seconds=current_app.config['SYNC_WINDOW']))
+
+
+def deleted_since(model, since):
+    if since is None:
+        return []
+    query = db.session.query(Tombstone.row_id).filter(Tombstone.table_name == model.__tablename__,
+                                                      Tombstone.deleted_at >= bind_value(since))
+    return sorted(set(id for (id,) in query))
+
+
+def purge_tombstones(connection, retention_days):
+    cutoff = datetime.utcnow().replace(microsecond=0) - timedelta(days=retention_days)
+    query = tombstone_table.delete().where(tombstone_table.c.deleted_at < bind_value(cutoff))
+    return connection.execute(query).rowcount
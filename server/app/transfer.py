@@ -0,0 +1,136 @@
+import json
+from datetime import datetime
+
+from sqlalchemy import bindparam
+
+from app.server import db
+from app.models import Project, Issue, Tag, Milestone, Effort, Column, Contact
+from app.bulk import CHUNK_SIZE
+from app.versions import touch
+
+# NDJSON backup format, one {"type": ..., "data": {column: value}} object per
+# line. Types are written parents first so an import never inserts a row
+# before the rows its foreign keys point at.
+TRANSFER_MODELS = [
+    ('contact', Contact),
+    ('project', Project),
+    ('tag', Tag),
+    ('milestone', Milestone),
+    ('effort', Effort),
+    ('column', Column),
+    ('issue', Issue),
+]
+
+DATETIME_FORMATS = ('%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S')
+
+
+class TransferError(ValueError):
+    def __init__(self, line, message):
+        super(TransferError, self).__init__('line %d: %s' % (line, message))
+        self.line = line
+
+
+def encode_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def is_datetime(column):
+    return isinstance(column.type, db.DateTime)
+
+
+def decode_value(column, value):
+    if value is None or not is_datetime(column):
+        return value
+    for format in DATETIME_FORMATS:
+        try:
+            value = datetime.strptime(value, format)
+        except (TypeError, ValueError):
+            continue
+        return stored_datetime(value)
+    raise ValueError('%s is not a datetime' % column.name)
+
+
+def stored_datetime(value):
+    # SQLite gets the text CURRENT_TIMESTAMP would store, or keyset pagination
+    # (which binds the same shape) would skip the row; pair with insert_statement()
+    if db.engine.name == 'sqlite':
+        return value.strftime('%Y-%m-%d %H:%M:%S.%f' if value.microsecond else '%Y-%m-%d %H:%M:%S')
+    return value
+
+
+def insert_statement(table):
+    if db.engine.name != 'sqlite':
+        return table.insert()
+    return table.insert().values(dict((column.name, bindparam(column.name, type_=db.String))
+                                      for column in table.columns if is_datetime(column)))
+
+
+def export_lines(connection, chunk_size=CHUNK_SIZE):
+    # stream_results asks drivers that support it for a server-side cursor;
+    # either way only chunk_size rows are held at a time
+    connection = connection.execution_options(stream_results=True)
+    for kind, model in TRANSFER_MODELS:
+        table = model.__table__
+        result = connection.execute(table.select().order_by(table.c.id))
+        while True:
+            rows = result.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield ''.join(json.dumps({'type': kind, 'data': dict(
+                (column.name, encode_value(row[column])) for column in table.columns)}) + '\n' for row in rows)
+        result.close()
+
+
+def import_lines(session, lines, chunk_size=CHUNK_SIZE):
+    # Inserts rows with their original ids, chunk_size rows per statement.
+    # Everything runs in the caller's transaction; commit once this returns.
+    tables = dict((kind, model.__table__) for kind, model in TRANSFER_MODELS)
+    inserts = dict((kind, insert_statement(table)) for kind, table in tables.items())
+    counts = dict((kind, 0) for kind, model in TRANSFER_MODELS)
+    pending, pending_kind = [], None
+
+    def flush():
+        if pending:
+            session.execute(inserts[pending_kind], pending)
+            counts[pending_kind] += len(pending)
+            del pending[:]
+
+    for number, line in enumerate(lines, 1):
+        if isinstance(line, bytes):
+            line = line.decode('utf-8')
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+            kind, data = record['type'], record['data']
+        except (ValueError, KeyError, TypeError):
+            raise TransferError(number, 'expected a {"type": ..., "data": {...}} object')
+        if kind not in tables:
+            raise TransferError(number, 'unknown type %r' % kind)
+        if not isinstance(data, dict) or not isinstance(data.get('id'), int):
+            raise TransferError(number, 'data needs an integer id')
+        table = tables[kind]
+        try:
+            row = dict((column.name, decode_value(column, data[column.name]))
+                       for column in table.columns if column.name in data)
+        except ValueError as e:
+            raise TransferError(number, str(e))
+
+        if kind != pending_kind or len(pending) >= chunk_size:
+            flush()
+            pending_kind = kind
+        pending.append(row)
+    flush()
+
+    imported = [kind for kind in counts if counts[kind]]
+    touch(session, [tables[kind].name for kind in imported])
+    if db.engine.name == 'postgresql':
+        # explicit ids don't advance the serial sequences
+        preparer = db.engine.dialect.identifier_preparer
+        for kind in imported:
+            name = preparer.format_table(tables[kind])
+            session.execute("SELECT setval(pg_get_serial_sequence('%s', 'id'), (SELECT max(id) FROM %s))"
+                            % (name, name))
+    return counts
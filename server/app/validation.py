@@ -0,0 +1,238 @@
+import re
+from datetime import datetime
+
+from flask import request
+from wtforms import StringField, TextAreaField, PasswordField, IntegerField, FloatField, BooleanField, \
+    DateTimeField
+from wtforms.validators import DataRequired, InputRequired, Optional, Length, Email
+from wtforms_alchemy import Unique
+
+# Request bodies are checked against schemas compiled once, at import, from
+# the form classes in app/forms.py: each field becomes a coercion and a list
+# of checks giving the same messages and the same {field: [messages]} errors
+# as the forms did, without binding a form per request or per bulk item.
+# Uniqueness is left to the database constraint; views turn the
+# IntegrityError into the field error with integrity_errors().
+
+REQUIRED = 'This field is required.'
+BOOLEAN_FALSE = ('false', '')
+
+
+class Invalid(Exception):
+    pass
+
+
+def text(value):
+    if not isinstance(value, str):
+        raise Invalid('Not a valid string value')
+    return value
+
+
+def integer(value):
+    if isinstance(value, bool):
+        raise Invalid('Not a valid integer value')
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise Invalid('Not a valid integer value')
+
+
+def number(value):
+    if isinstance(value, bool):
+        raise Invalid('Not a valid float value')
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        raise Invalid('Not a valid float value')
+
+
+def boolean(value):
+    # JSON false is false; a form post sends the strings
+    if isinstance(value, str):
+        return value.lower() not in BOOLEAN_FALSE
+    return bool(value)
+
+
+def timestamp(format):
+    def coerce(value):
+        try:
+            return datetime.strptime(value, format)
+        except (TypeError, ValueError):
+            raise Invalid('Not a valid datetime value')
+    return coerce
+
+
+COERCIONS = [
+    ((StringField, TextAreaField, PasswordField), text),
+    ((IntegerField,), integer),
+    ((FloatField,), number),
+    ((BooleanField,), boolean),
+]
+
+
+def coercion(unbound):
+    if issubclass(unbound.field_class, DateTimeField):
+        return timestamp(unbound.kwargs.get('format', '%Y-%m-%d %H:%M:%S'))
+    for classes, coerce in COERCIONS:
+        if issubclass(unbound.field_class, classes):
+            return coerce
+    raise TypeError('no schema for %s fields' % unbound.field_class.__name__)
+
+
+def blank(value):
+    return value is None or isinstance(value, str) and not value.strip()
+
+
+def length_check(validator):
+    if validator.message is not None:
+        message = validator.message
+    elif validator.max == -1:
+        message = 'Field must be at least %(min)d characters long.'
+    elif validator.min == -1:
+        message = 'Field cannot be longer than %(max)d characters.'
+    else:
+        message = 'Field must be between %(min)d and %(max)d characters long.'
+
+    def check(value):
+        size = len(value) if value else 0
+        if size < validator.min or validator.max != -1 and size > validator.max:
+            return message % dict(min=validator.min, max=validator.max, length=size)
+    return check
+
+
+def email_check(validator):
+    message = validator.message or 'Invalid email address.'
+
+    def check(value):
+        if not isinstance(value, str) or not validator.regex.match(value):
+            return message
+    return check
+
+
+class Field(object):
+    def __init__(self, name, unbound):
+        self.name = name
+        self.coerce = coercion(unbound)
+        self.default = unbound.kwargs.get('default')
+        if self.default is None and self.coerce is text:
+            # a text field left out of the body is '' in form.data
+            self.default = ''
+        self.required = None  # message for a missing or blank value
+        self.optional = False
+        self.checks = []
+        self.unique = None
+        for validator in unbound.kwargs.get('validators') or ():
+            if isinstance(validator, (DataRequired, InputRequired)):
+                self.required = self.required or validator.message or REQUIRED
+            elif isinstance(validator, Optional):
+                self.optional = True
+            elif isinstance(validator, Length):
+                self.checks.append(length_check(validator))
+            elif isinstance(validator, Email):
+                self.checks.append(email_check(validator))
+            elif isinstance(validator, Unique):
+                self.unique = validator.message or 'Already exists.'
+            else:
+                raise TypeError('no schema for the %s validator of %s' % (type(validator).__name__, name))
+
+    def validate(self, value):
+        # (value, error message)
+        if blank(value):
+            if self.required:
+                return None, self.required
+            if value is None:
+                return self.default, None
+            if self.optional:
+                # a blank string stays as it was sent, anything else blank is left out
+                return (value if self.coerce is text else self.default), None
+        try:
+            value = self.coerce(value)
+        except Invalid as e:
+            return None, str(e)
+        for check in self.checks:
+            message = check(value)
+            if message:
+                return value, message
+        return value, None
+
+
+class Value(object):
+    __slots__ = ('data',)
+
+    def __init__(self, data):
+        self.data = data
+
+
+class Validated(object):
+    # what a view used of a bound form: validate_on_submit(), errors and
+    # form.<field>.data
+
+    def __init__(self, schema, data):
+        self.schema = schema
+        self.input = data
+        self.data = {}
+        self.errors = {}
+
+    def validate(self):
+        self.data, self.errors = self.schema.validate(self.input)
+        return not self.errors
+
+    def validate_on_submit(self):
+        # whatever the method, so PATCH and PUT bodies are checked too
+        return self.validate()
+
+    def integrity_errors(self, error):
+        return self.schema.integrity_errors(error)
+
+    def __getattr__(self, name):
+        if name not in self.schema.names:
+            raise AttributeError(name)
+        return Value(self.data.get(name))
+
+
+class Schema(object):
+    def __init__(self, form_class):
+        self.form_class = form_class
+        self.fields = []
+        for name in dir(form_class):
+            unbound = getattr(form_class, name)
+            if not name.startswith('_') and hasattr(unbound, 'field_class'):
+                self.fields.append(Field(name, unbound))
+        self.fields.sort(key=lambda field: getattr(form_class, field.name).creation_counter)
+        self.names = frozenset(field.name for field in self.fields)
+
+    def validate(self, item):
+        # (values, errors) of a dict; JSON null means the field was left out
+        data, errors = {}, {}
+        if not isinstance(item, dict):
+            return data, {'item': ['Expected a JSON object']}
+        for field in self.fields:
+            value, message = field.validate(item.get(field.name))
+            data[field.name] = value
+            if message:
+                errors[field.name] = [message]
+        return data, errors
+
+    def integrity_errors(self, error):
+        # the error of the unique field a failed insert or update names
+        detail = str(error.orig)
+        for field in self.fields:
+            if field.unique and re.search(r'\b%s\b' % re.escape(field.name), detail) and 'unique' in detail.lower():
+                return {field.name: [field.unique]}
+        return {'message': detail}
+
+    def __call__(self, data=None):
+        if data is None:
+            data = request_data()
+        return Validated(self, data)
+
+
+def request_data():
+    data = request.get_json(silent=True)
+    if data is None:
+        data = request.form.to_dict()
+    return data
+
+
+def compiled(form_class):
+    return Schema(form_class)
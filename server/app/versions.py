@@ -0,0 +1,97 @@
+import hashlib
+from functools import wraps
+
+from flask import request
+from flask.ext.restful.utils import unpack
+from sqlalchemy import event
+from sqlalchemy.orm import Session, scoped_session
+from werkzeug.http import quote_etag
+from werkzeug.wrappers import BaseResponse
+
+from app.server import app, db
+from app.metrics import count_cache
+from app.models import TableVersion
+
+version_table = TableVersion.__table__
+
+
+def touch(session, tables):
+    tables = set(tables) - set([version_table.name])
+    if not tables:
+        return
+    # remembered until the transaction ends, see app.cache
+    real_session = session() if isinstance(session, scoped_session) else session
+    real_session.info.setdefault('touched_tables', set()).update(tables)
+    result = session.execute(version_table.update()
+                             .where(version_table.c.name.in_(tables))
+                             .values(version=version_table.c.version + 1))
+    if result.rowcount < len(tables):
+        existing = set(name for (name,) in session.execute(
+            db.select([version_table.c.name]).where(version_table.c.name.in_(tables))))
+        session.execute(version_table.insert(), [{'name': name, 'version': 1} for name in tables - existing])
+
+
+def table_versions(tables):
+    rows = db.session.query(TableVersion.name, TableVersion.version).filter(TableVersion.name.in_(tables))
+    return dict(rows.all())
+
+
+@event.listens_for(version_table, 'after_create')
+def seed_versions(target, connection, **kw):
+    names = [name for name in db.metadata.tables if name != target.name]
+    connection.execute(target.insert(), [{'name': name, 'version': 0} for name in names])
+
+
+@event.listens_for(Session, 'after_flush')
+def touch_flushed(session, flush_context):
+    tables = set(obj.__tablename__ for obj in session.new)
+    tables.update(obj.__tablename__ for obj in session.deleted)
+    tables.update(obj.__tablename__ for obj in session.dirty
+                  if session.is_modified(obj, include_collections=False))
+    touch(session, tables)
+
+
+@event.listens_for(Session, 'after_bulk_update')
+@event.listens_for(Session, 'after_bulk_delete')
+def touch_bulk(context):
+    if context.rowcount:
+        touch(context.session, [context.primary_table.name])
+
+
+def etag_for(tables):
+    versions = table_versions(tables)
+    key = '%s|%s' % (request.full_path, ','.join('%s:%d' % (t, versions.get(t, 0)) for t in tables))
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def etagged(*models, extra=None):
+    # extra(): further models the body of this request depends on
+    tables = sorted(set(model.__tablename__ for model in models))
+
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            request_tables = tables
+            if extra is not None:
+                request_tables = sorted(set(tables).union(model.__tablename__ for model in extra()))
+            # read the versions before the data, so a concurrent write can only
+            # make the tag older than the body and never the other way round
+            etag = etag_for(request_tables)
+            # weak comparison: app.compression marks the tags of compressed bodies weak
+            if request.if_none_match:
+                count_cache('etag', request.if_none_match.contains_weak(etag))
+            if request.if_none_match.contains_weak(etag):
+                response = app.response_class(status=304)
+                response.set_etag(etag)
+                return response
+
+            rv = f(*args, **kwargs)
+            if isinstance(rv, BaseResponse):
+                rv.set_etag(etag)
+                return rv
+            data, code, headers = unpack(rv)
+            if code == 200:
+                headers = dict(headers, ETag=quote_etag(etag))
+            return data, code, headers
+        return wrapper
+    return decorator
@@ -1,21 +1,81 @@
-from flask import g
+from collections import defaultdict
+
+from flask import g, request, Response, stream_with_context
 from flask.ext import restful
+from sqlalchemy.exc import IntegrityError
 
-from app.server import api, db, flask_bcrypt, auth
+from app.server import app, api, db, auth
 from app.models import User, Post, ToDo, Contact, Project, Issue, Tag, Milestone, Effort, Column
 from app.forms import UserCreateForm, SessionCreateForm, PostCreateForm, ToDoCreateForm, ToDoCompleteForm, \
-    ContactCreateForm, ContactUpdateForm, ProjectCreateForm, ProjectUpdateForm, IssueCreateForm, TagCreateForm, MilestoneCreateForm, EffortCreateForm, ColumnCreateForm
+    ContactCreateForm, ContactUpdateForm, ProjectCreateForm, ProjectUpdateForm, IssueCreateForm, IssueMoveForm, TagCreateForm, MilestoneCreateForm, EffortCreateForm, ColumnCreateForm
 from app.serializers import UserSerializer, PostSerializer, ToDoSerializer, ContactSerializer, ProjectSerializer, IssueSerializer, \
     TagSerializer, MilestoneSerializer, EffortSerializer, ColumnSerializer
+from app.pagination import paginate, page_limit
+from app.search import search
+from app.stats import project_stats, done_column_ids
+from app.positions import move_issue
+from app.events import bus, event_stream, stream_slots
+from app.versions import etagged, table_versions
+from app.cache import cached
+from app.metrics import registry, render, count_cache, CONTENT_TYPE
+from app.batch import batch, bootstrap
+from app.expand import Expands
+from app.passwords import verify_user
+from app.auth import CredentialCache, Identity, generate_token, load_token
+from app.transfer import TransferError, export_lines, import_lines
+from app.bulk import is_bulk, bulk_create, bulk_update, bulk_delete, delete_where, delete_ids, deleted_response, \
+    id_list
+
+
+def todo_values(form):
+    return dict(text=form.text.data, is_complete=form.is_complete.data, status='Active')
+
+
+def todo_complete_values(form):
+    return dict(is_complete=form.is_complete.data, status='Completed' if form.is_complete.data else 'Active')
+
+
+def contact_values(form):
+    return dict(text=form.text.data, first_name=form.first_name.data, last_name=form.last_name.data,
+                is_selected=form.is_selected.data)
+
+
+def contact_update_values(form):
+    return dict(first_name=form.first_name.data, last_name=form.last_name.data, text=form.text.data)
+
+
+def issue_values(form):
+    return dict(title=form.title.data, description=form.description.data, project_id=form.project_id.data,
+                column_id=form.column_id.data, tag_id=form.tag_id.data, milestone_id=form.milestone_id.data,
+                effort_id=form.effort_id.data, assigned_to_id=form.assigned_to_id.data)
+
+
+credential_cache = CredentialCache(app.config['CREDENTIAL_CACHE_SIZE'])
 
 
 @auth.verify_password
 def verify_password(email, password):
-    user = User.query.filter_by(email=email).first()
-    if not user:
+    key = credential_cache.key(email, password)
+    version = table_versions([User.__tablename__]).get(User.__tablename__, 0)
+    identity = credential_cache.get(key, version)
+    count_cache('credential', identity is not None)
+    if identity is None:
+        user = User.query.filter_by(email=email).first()
+        if not user or not verify_user(user, password):
+            return False
+        identity = Identity(user.id, user.email)
+        credential_cache.put(key, version, identity)
+    g.user = identity
+    return True
+
+
+@auth.verify_token
+def verify_token(token):
+    identity = load_token(token)
+    if identity is None:
         return False
-    g.user = user
-    return flask_bcrypt.check_password_hash(user.password, password)
+    g.user = identity
+    return True
 
 
 class UserView(restful.Resource):
@@ -24,9 +84,14 @@ class UserView(restful.Resource):
         if not form.validate_on_submit():
             return form.errors, 422
 
+        # the email's unique constraint does the duplicate check
         user = User(form.email.data, form.password.data)
         db.session.add(user)
-        db.session.commit()
+        try:
+            db.session.commit()
+        except IntegrityError as e:
+            db.session.rollback()
+            return form.integrity_errors(e), 422
         return UserSerializer(user).data
 
 
@@ -37,15 +102,23 @@ class SessionView(restful.Resource):
             return form.errors, 422
 
         user = User.query.filter_by(email=form.email.data).first()
-        if user and flask_bcrypt.check_password_hash(user.password, form.password.data):
-            return UserSerializer(user).data, 201
+        if user and verify_user(user, form.password.data):
+            data = UserSerializer(user).data
+            data['token'] = generate_token(user)
+            data['expires_in'] = app.config['TOKEN_EXPIRATION']
+            return data, 201
         return '', 401
 
 
 class PostListView(restful.Resource):
+    filters = ('user_id',)
+    sorts = ('id', 'title', 'created_at')
+
+    @etagged(Post, User)
     def get(self):
-        posts = Post.query.all()
-        return PostSerializer(posts, many=True).data
+        # the nested user comes in the same query rather than one per post
+        return paginate(Post, PostSerializer, Post.query.options(db.joinedload(Post.user)), filters=self.filters,
+                        sorts=self.sorts)
 
     @auth.login_required
     def post(self):
@@ -59,17 +132,23 @@ class PostListView(restful.Resource):
 
 
 class PostView(restful.Resource):
+    @etagged(Post, User)
     def get(self, id):
-        posts = Post.query.filter_by(id=id).first()
+        posts = Post.query.options(db.joinedload(Post.user)).filter_by(id=id).first()
         return PostSerializer(posts).data
 
 
 class ToDoListView(restful.Resource):
+    filters = ('is_complete', 'status')
+    sorts = ('id', 'text', 'created_at')
+
+    @etagged(ToDo)
     def get(self):
-        todos = ToDo.query.all()
-        return ToDoSerializer(todos, many=True).data
+        return paginate(ToDo, ToDoSerializer, filters=self.filters, sorts=self.sorts)
 
     def post(self):
+        if is_bulk():
+            return bulk_create(ToDo, ToDoCreateForm, todo_values, ToDoSerializer)
         form = ToDoCreateForm()
         if not form.validate_on_submit():
             return form.errors, 422
@@ -78,16 +157,19 @@ class ToDoListView(restful.Resource):
         db.session.commit()
         return ToDoSerializer(todo).data, 201
 
+    def put(self):
+        return bulk_update(ToDo, ToDoCompleteForm, todo_complete_values, ToDoSerializer)
+
     def delete(self):
-        toDelete = ToDo.query.filter(ToDo.is_complete == True).all()
-        for todo in toDelete:
-            db.session.delete(todo)
+        if is_bulk():
+            return bulk_delete(ToDo)
+        delete_where(ToDo, ToDo.is_complete == True)
         db.session.commit()
-        todos = ToDo.query.all()
-        return ToDoSerializer(todos, many=True).data, 201
+        return deleted_response(ToDo, ToDoSerializer, 201)
 
 
 class ToDoView(restful.Resource):
+    @etagged(ToDo)
     def get(self, id):
         todos = ToDo.query.filter_by(id=id).first()
         return ToDoSerializer(todos).data
@@ -107,11 +189,17 @@ class ToDoView(restful.Resource):
 
 
 class ContactListView(restful.Resource):
+    filters = ('is_selected',)
+    sorts = ('id', 'first_name', 'last_name', 'created_at')
+
+    @cached(Contact)
+    @etagged(Contact)
     def get(self):
-        contacts = Contact.query.all()
-        return ContactSerializer(contacts, many=True).data
+        return paginate(Contact, ContactSerializer, filters=self.filters, sorts=self.sorts)
 
     def post(self):
+        if is_bulk():
+            return bulk_create(Contact, ContactCreateForm, contact_values, ContactSerializer)
         form = ContactCreateForm()
         if not form.validate_on_submit():
             return form.errors, 422
@@ -120,16 +208,20 @@ class ContactListView(restful.Resource):
         db.session.commit()
         return ContactSerializer(contact).data, 201
 
+    def put(self):
+        return bulk_update(Contact, ContactUpdateForm, contact_update_values, ContactSerializer)
+
     def delete(self):
-        toDelete = Contact.query.filter(Contact.is_selected == True).all()
-        for contact in toDelete:
-            db.session.delete(contact)
+        if is_bulk():
+            return bulk_delete(Contact)
+        delete_where(Contact, Contact.is_selected == True)
         db.session.commit()
-        contacts = Contact.query.all()
-        return ContactSerializer(contacts, many=True).data, 201
+        return deleted_response(Contact, ContactSerializer, 201)
 
 
 class ContactView(restful.Resource):
+    @cached(Contact)
+    @etagged(Contact)
     def get(self, id):
         contacts = Contact.query.filter_by(id=id).first()
         return ContactSerializer(contacts).data
@@ -149,14 +241,16 @@ class ContactView(restful.Resource):
         contact = Contact.query.filter_by(id=id).first()
         db.session.delete(contact)
         db.session.commit()
-        contacts = Contact.query.all()
-        return ContactSerializer(contacts, many=True).data
+        return deleted_response(Contact, ContactSerializer)
 
 
 class ProjectListView(restful.Resource):
+    filters = ('user_id',)
+    sorts = ('id', 'name', 'created_at')
+
+    @etagged(Project)
     def get(self):
-        projects = Project.query.all()
-        return ProjectSerializer(projects, many=True).data
+        return paginate(Project, ProjectSerializer, filters=self.filters, sorts=self.sorts)
 
     def post(self):
         form = ProjectCreateForm()
@@ -168,6 +262,7 @@ class ProjectListView(restful.Resource):
         return ProjectSerializer(project).data, 201
 
 class ProjectView(restful.Resource):
+    @etagged(Project)
     def get(self, id):
         projects = Project.query.filter_by(id=id).first()
         return ProjectSerializer(projects).data
@@ -187,16 +282,65 @@ class ProjectView(restful.Resource):
         project = Project.query.filter_by(id=id).first()
         db.session.delete(project)
         db.session.commit()
-        projects = Project.query.all()
-        return ProjectSerializer(projects, many=True).data
+        return deleted_response(Project, ProjectSerializer)
+
+
+class ProjectBoardView(restful.Resource):
+    @etagged(Project, Column, Issue)
+    def get(self, id):
+        Project.query.get_or_404(id)
+        columns = Column.query.order_by(Column.id).all()
+        issues = Issue.query.filter_by(project_id=id).order_by(Issue.position, Issue.id).all()
+        tasks = defaultdict(list)
+        for issue in IssueSerializer(issues, many=True).data:
+            tasks[issue['column_id']].append(issue)
+        board = ColumnSerializer(columns, many=True, exclude=('tasks',)).data
+        for column in board:
+            column['tasks'] = tasks[column['id']]
+        return board
+
+
+class ProjectStatsView(restful.Resource):
+    @etagged(Project, Column, Issue)
+    def get(self, id):
+        Project.query.get_or_404(id)
+        # ?done=3,4 overrides which columns count as done for milestone completion
+        done = id_list(request.args['done']) if 'done' in request.args else done_column_ids()
+        return project_stats(id, set(done))
+
+
+class ProjectEventsView(restful.Resource):
+    def get(self, id):
+        Project.query.get_or_404(id)
+        if bus is None:
+            return {'message': 'Live updates are disabled'}, 501
+        if not stream_slots.acquire(False):
+            return {'message': 'Too many live update streams on this server, try again shortly'}, 503
+        # give the connection back now; the stream can stay open for hours
+        db.session.remove()
+        response = Response(event_stream(id), mimetype='text/event-stream',
+                            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+        # also when the client leaves before the stream starts
+        response.call_on_close(stream_slots.release)
+        return response
+
+
+issue_expands = Expands(Issue, {'tag': TagSerializer, 'milestone': MilestoneSerializer, 'effort': EffortSerializer,
+                                'assigned_to': ContactSerializer, 'project': ProjectSerializer})
 
 
 class IssueListView(restful.Resource):
+    filters = ('project_id', 'column_id', 'tag_id', 'milestone_id', 'effort_id', 'assigned_to_id')
+    sorts = ('id', 'title', 'created_at', 'project_id', 'column_id', 'position')
+
+    @etagged(Issue, extra=issue_expands.models)
     def get(self):
-        issues = Issue.query.all()
-        return IssueSerializer(issues, many=True).data
+        return paginate(Issue, IssueSerializer, filters=self.filters, sorts=self.sorts,
+                        extend=issue_expands.expander())
 
     def post(self):
+        if is_bulk():
+            return bulk_create(Issue, IssueCreateForm, issue_values, IssueSerializer)
         form = IssueCreateForm()
         if not form.validate_on_submit():
             return form.errors, 422
@@ -206,11 +350,24 @@ class IssueListView(restful.Resource):
         db.session.commit()
         return IssueSerializer(issue).data, 201
 
+    def put(self):
+        return bulk_update(Issue, IssueCreateForm, issue_values, IssueSerializer)
+
+    def delete(self):
+        if 'ids' in request.args:
+            delete_ids(Issue, id_list(request.args['ids']))
+            db.session.commit()
+            return deleted_response(Issue, IssueSerializer)
+        return bulk_delete(Issue)
+
 
 class IssueView(restful.Resource):
+    @etagged(Issue, extra=issue_expands.models)
     def get(self, id):
         issues = Issue.query.filter_by(id=id).first()
-        return IssueSerializer(issues).data
+        data = IssueSerializer(issues).data
+        expander = issue_expands.expander()
+        return expander([data])[0] if expander else data
 
     def put(self, id):
         form = IssueCreateForm()
@@ -232,14 +389,42 @@ class IssueView(restful.Resource):
         issue = Issue.query.filter_by(id=id).first()
         db.session.delete(issue)
         db.session.commit()
-        issues = Issue.query.all()
-        return IssueSerializer(issues, many=True).data
+        return deleted_response(Issue, IssueSerializer)
+
+
+class IssueMoveView(restful.Resource):
+    def patch(self, id):
+        issue = Issue.query.get_or_404(id)
+        form = IssueMoveForm()
+        if not form.validate_on_submit():
+            return form.errors, 422
+        column_id = form.column_id.data or issue.column_id
+        if form.column_id.data is not None and not Column.query.get(column_id):
+            return {'column_id': ['Not found']}, 422
+        if form.before.data is not None and form.after.data is not None:
+            return {'before': ['Give either before or after']}, 422
+        neighbours = {}
+        for name in ('before', 'after'):
+            neighbour_id = getattr(form, name).data
+            if neighbour_id is None:
+                continue
+            neighbour = Issue.query.get(neighbour_id)
+            if neighbour is None or neighbour.column_id != column_id or neighbour.id == issue.id:
+                return {name: ['Not an issue in the target column']}, 422
+            neighbours[name] = neighbour
+        move_issue(issue, column_id, **neighbours)
+        db.session.commit()
+        return IssueSerializer(issue).data
 
 
 class TagListView(restful.Resource):
+    filters = ('color',)
+    sorts = ('id', 'name')
+
+    @cached(Tag)
+    @etagged(Tag)
     def get(self):
-        tags = Tag.query.all()
-        return TagSerializer(tags, many=True).data
+        return paginate(Tag, TagSerializer, filters=self.filters, sorts=self.sorts)
 
     def post(self):
         form = TagCreateForm()
@@ -252,6 +437,8 @@ class TagListView(restful.Resource):
 
 
 class TagView(restful.Resource):
+    @cached(Tag)
+    @etagged(Tag)
     def get(self, id):
         tags = Tag.query.filter_by(id=id).first()
         return TagSerializer(tags).data
@@ -271,10 +458,11 @@ class TagView(restful.Resource):
         tag = Tag.query.filter_by(id=id).first()
         db.session.delete(tag)
         db.session.commit()
-        tags = Tag.query.all()
-        return TagSerializer(tags, many=True).data
+        return deleted_response(Tag, TagSerializer)
 
 class MilestoneView(restful.Resource):
+    @cached(Milestone)
+    @etagged(Milestone)
     def get(self, id):
         milestones = Milestone.query.filter_by(id=id).first()
         return MilestoneSerializer(milestones).data
@@ -295,13 +483,16 @@ class MilestoneView(restful.Resource):
         milestone = Milestone.query.filter_by(id=id).first()
         db.session.delete(milestone)
         db.session.commit()
-        milestones = Milestone.query.all()
-        return MilestoneSerializer(milestones, many=True).data
+        return deleted_response(Milestone, MilestoneSerializer)
 
 class MilestoneListView(restful.Resource):
+    filters = ('status',)
+    sorts = ('id', 'name', 'due_date')
+
+    @cached(Milestone)
+    @etagged(Milestone)
     def get(self):
-        milestones = Milestone.query.all()
-        return MilestoneSerializer(milestones, many=True).data
+        return paginate(Milestone, MilestoneSerializer, filters=self.filters, sorts=self.sorts)
 
     def post(self):
         form = MilestoneCreateForm()
@@ -313,9 +504,13 @@ class MilestoneListView(restful.Resource):
         return MilestoneSerializer(milestone).data, 201
 
 class EffortListView(restful.Resource):
+    filters = ()
+    sorts = ('id', 'name')
+
+    @cached(Effort)
+    @etagged(Effort)
     def get(self):
-        efforts = Effort.query.all()
-        return EffortSerializer(efforts, many=True).data
+        return paginate(Effort, EffortSerializer, filters=self.filters, sorts=self.sorts)
 
     def post(self):
         form = EffortCreateForm()
@@ -327,6 +522,8 @@ class EffortListView(restful.Resource):
         return EffortSerializer(effort).data, 201
 
 class EffortView(restful.Resource):
+    @cached(Effort)
+    @etagged(Effort)
     def get(self, id):
         efforts = Effort.query.filter_by(id=id).first()
         return EffortSerializer(efforts).data
@@ -345,13 +542,17 @@ class EffortView(restful.Resource):
         effort = Effort.query.filter_by(id=id).first()
         db.session.delete(effort)
         db.session.commit()
-        efforts = Effort.query.all()
-        return TagSerializer(efforts, many=True).data
+        return deleted_response(Effort, EffortSerializer)
 
 class ColumnListView(restful.Resource):
+    filters = ()
+    sorts = ('id', 'name', 'created_at')
+
+    @cached(Column, Issue)
+    @etagged(Column, Issue)
     def get(self):
-        columns = Column.query.all()
-        return ColumnSerializer(columns, many=True).data
+        return paginate(Column, ColumnSerializer, Column.query.options(db.subqueryload(Column.tasks)),
+                        filters=self.filters, sorts=self.sorts)
 
     def post(self):
         form = ColumnCreateForm()
@@ -364,6 +565,8 @@ class ColumnListView(restful.Resource):
         return ColumnSerializer(column).data, 201
 
 class ColumnView(restful.Resource):
+    @cached(Column, Issue)
+    @etagged(Column, Issue)
     def get(self, id):
         column = Column.query.filter_by(id=id).first()
         return ColumnSerializer(column).data
@@ -382,8 +585,54 @@ class ColumnView(restful.Resource):
         column = Column.query.filter_by(id=id).first()
         db.session.delete(column)
         db.session.commit()
-        columns = Column.query.all()
-        return ColumnSerializer(columns, many=True).data
+        return deleted_response(Column, ColumnSerializer, query=Column.query.options(db.subqueryload(Column.tasks)))
+
+class SearchView(restful.Resource):
+    @etagged(Issue, Post, ToDo, Contact)
+    def get(self):
+        kinds = [kind for kind in request.args.get('type', '').split(',') if kind]
+        limit = page_limit()
+        offset = max(request.args.get('offset', 0, type=int), 0)
+        hits, has_more = search(request.args.get('q', ''), kinds, limit, offset)
+        return {'items': hits, 'next_offset': offset + limit if has_more else None}
+
+class MetricsView(restful.Resource):
+    def get(self):
+        if registry is None:
+            return {'message': 'Metrics are disabled'}, 501
+        return Response(render(registry.samples()), content_type=CONTENT_TYPE)
+
+
+class BatchView(restful.Resource):
+    def post(self):
+        return batch()
+
+
+class BootstrapView(restful.Resource):
+    @etagged(Contact, Project, Tag, Milestone, Effort, Column, Issue)
+    def get(self):
+        return bootstrap()
+
+
+class ExportView(restful.Resource):
+    @auth.login_required
+    def get(self):
+        return Response(stream_with_context(export_lines(db.session.connection())), mimetype='application/x-ndjson')
+
+
+class ImportView(restful.Resource):
+    @auth.login_required
+    def post(self):
+        try:
+            counts = import_lines(db.session, request.stream)
+            db.session.commit()
+        except TransferError as e:
+            db.session.rollback()
+            return {'message': str(e)}, 400
+        except IntegrityError as e:
+            db.session.rollback()
+            return {'message': str(e.orig)}, 422
+        return counts, 201
 
 api.add_resource(UserView, '/api/v1/users')
 api.add_resource(SessionView, '/api/v1/sessions')
@@ -395,8 +644,12 @@ api.add_resource(ContactListView, '/api/v1/contacts')
 api.add_resource(ContactView, '/api/v1/contacts/<int:id>')
 api.add_resource(ProjectListView, '/api/v1/projects')
 api.add_resource(ProjectView, '/api/v1/projects/<int:id>')
+api.add_resource(ProjectBoardView, '/api/v1/projects/<int:id>/board')
+api.add_resource(ProjectStatsView, '/api/v1/projects/<int:id>/stats')
+api.add_resource(ProjectEventsView, '/api/v1/projects/<int:id>/events')
 api.add_resource(IssueListView, '/api/v1/issues')
 api.add_resource(IssueView, '/api/v1/issues/<int:id>')
+api.add_resource(IssueMoveView, '/api/v1/issues/<int:id>/move')
 api.add_resource(TagListView, '/api/v1/tags')
 api.add_resource(TagView, '/api/v1/tags/<int:id>')
 api.add_resource(MilestoneListView, '/api/v1/milestones')
@@ -404,4 +657,10 @@ api.add_resource(MilestoneView, '/api/v1/milestones/<int:id>')
 api.add_resource(EffortListView, '/api/v1/efforts')
 api.add_resource(EffortView, '/api/v1/efforts/<int:id>')
 api.add_resource(ColumnListView, '/api/v1/columns')
-api.add_resource(ColumnView, '/api/v1/columns/<int:id>')
\ No newline at end of file
+api.add_resource(ColumnView, '/api/v1/columns/<int:id>')
+api.add_resource(SearchView, '/api/v1/search')
+api.add_resource(BatchView, '/api/v1/batch')
+api.add_resource(BootstrapView, '/api/v1/bootstrap')
+api.add_resource(ExportView, '/api/v1/export')
+api.add_resource(ImportView, '/api/v1/import')
+api.add_resource(MetricsView, '/metrics')
\ No newline at end of file
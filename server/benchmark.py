@@ -0,0 +1,238 @@
+import argparse
+import base64
+import json
+import re
+import resource
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.client import HTTPConnection
+from urllib.parse import urlsplit
+
+from sqlalchemy import event
+
+from app.server import app, db
+from app.seed import PASSWORD
+
+# Requests every GET route registered with api.add_resource, in-process
+# through the Flask test client or over HTTP against a running server, and
+# reports throughput, latency percentiles, queries per request (counted
+# in-process, or read from Server-Timing headers over HTTP) and peak RSS.
+# Seed the database with db_seed.py first; routes take id 1.
+#   python3 benchmark.py --save baseline.json
+#   python3 benchmark.py --baseline baseline.json
+#   python3 benchmark.py --url http://localhost:5005 --pid <server pid> --concurrency 8
+
+# never finish, or are not reads
+SKIPPED = ('/api/v1/projects/<int:id>/events',)
+
+# extra query strings requested for a route besides the bare path
+VARIANTS = {
+    '/api/v1/issues': ['?limit=50', '?limit=50&sort=-created_at', '?project_id=1&limit=50'],
+    '/api/v1/posts': ['?limit=50'],
+    '/api/v1/contacts': ['?limit=50'],
+    '/api/v1/projects': ['?limit=50'],
+    '/api/v1/search': ['?q=login', '?q=crash&type=issue'],
+}
+
+
+def targets(pattern=None):
+    paths = []
+    for rule in sorted(app.url_map.iter_rules(), key=lambda rule: rule.rule):
+        view = app.view_functions.get(rule.endpoint)
+        if not hasattr(view, 'view_class') or 'GET' not in rule.methods or rule.rule in SKIPPED:
+            continue
+        path = rule.rule.replace('<int:id>', '1')
+        for query in ([''] if rule.rule != '/api/v1/search' else []) + VARIANTS.get(rule.rule, []):
+            if pattern is None or pattern in path + query:
+                paths.append(path + query)
+    return paths
+
+
+def timing_queries(header):
+    # query count from the Server-Timing header of app/profiling.py
+    match = re.search(r'db;[^,]*desc="(\d+) queries"', header or '')
+    return int(match.group(1)) if match else None
+
+
+def auth_header(email, password):
+    credentials = ('%s:%s' % (email, password)).encode('utf-8')
+    return {'Authorization': 'Basic ' + base64.b64encode(credentials).decode('ascii')}
+
+
+class TestClient(object):
+    # in-process: no sockets, and queries and memory can be measured directly
+
+    def __init__(self, headers):
+        self.headers = headers
+        self.local = threading.local()
+
+    def get(self, path):
+        if not hasattr(self.local, 'client'):
+            self.local.client = app.test_client()
+        response = self.local.client.get(path, headers=self.headers)
+        return response.status_code, len(response.data), timing_queries(response.headers.get('Server-Timing'))
+
+
+class HTTPClient(object):
+    # one keep-alive connection per thread
+
+    def __init__(self, url, headers):
+        parts = urlsplit(url)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self.headers = headers
+        self.local = threading.local()
+
+    def get(self, path):
+        if not hasattr(self.local, 'connection'):
+            self.local.connection = HTTPConnection(self.host, self.port, timeout=60)
+        connection = self.local.connection
+        try:
+            connection.request('GET', path, headers=self.headers)
+            response = connection.getresponse()
+            body = response.read()
+        except (OSError, ValueError):
+            connection.close()
+            del self.local.connection
+            raise
+        return response.status, len(body), timing_queries(response.getheader('Server-Timing'))
+
+
+class QueryCounter(object):
+    def __init__(self, engines):
+        self.count = 0
+        self.lock = threading.Lock()
+        for engine in engines:
+            event.listen(engine, 'before_cursor_execute', self.executed)
+
+    def executed(self, conn, cursor, statement, parameters, context, executemany):
+        with self.lock:
+            self.count += 1
+
+
+def percentile(values, share):
+    # nearest rank
+    index = max(int(round(share * len(values) + 0.5)) - 1, 0)
+    return values[min(index, len(values) - 1)]
+
+
+def peak_rss(pid=None):
+    # high-water mark in MB, of this process or of the server's
+    if pid is None:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+    with open('/proc/%d/status' % pid) as status:
+        for line in status:
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1]) / 1024.0
+    return None
+
+
+def run(client, path, requests, concurrency, counter=None):
+    def timed(i):
+        started = time.perf_counter()
+        status, size, queries = client.get(path)
+        return time.perf_counter() - started, status, size, queries
+
+    queries = counter.count if counter else 0
+    started = time.perf_counter()
+    if concurrency == 1:
+        results = [timed(i) for i in range(requests)]
+    else:
+        with ThreadPoolExecutor(concurrency) as pool:
+            results = list(pool.map(timed, range(requests)))
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(result[0] for result in results)
+    if counter:
+        queries = (counter.count - queries) / float(requests)
+    else:
+        # over HTTP only sampled responses say how many queries they ran
+        counts = [result[3] for result in results if result[3] is not None]
+        queries = sum(counts) / float(len(counts)) if counts else None
+    return {
+        'requests': requests,
+        'errors': sum(1 for result in results if result[1] >= 400),
+        'bytes': results[-1][2],
+        'rps': round(requests / elapsed, 1),
+        'p50': round(percentile(latencies, 0.50) * 1000, 2),
+        'p95': round(percentile(latencies, 0.95) * 1000, 2),
+        'p99': round(percentile(latencies, 0.99) * 1000, 2),
+        'queries': None if queries is None else round(queries, 1),
+    }
+
+
+def regressions(name, result, base, tolerance):
+    found = []
+    if result['p95'] > base['p95'] * (1 + tolerance):
+        found.append('p95 %.2fms -> %.2fms' % (base['p95'], result['p95']))
+    if result['rps'] < base['rps'] * (1 - tolerance):
+        found.append('rps %.1f -> %.1f' % (base['rps'], result['rps']))
+    if result['queries'] is not None and base.get('queries') is not None and result['queries'] > base['queries']:
+        found.append('queries %.1f -> %.1f' % (base['queries'], result['queries']))
+    if result['errors'] > base['errors']:
+        found.append('errors %d -> %d' % (base['errors'], result['errors']))
+    return ['%s: %s' % (name, change) for change in found]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the GET routes of the API.')
+    parser.add_argument('--url', help='benchmark a running server instead of the test client')
+    parser.add_argument('--pid', type=int, help='server process id, for its peak RSS (with --url)')
+    parser.add_argument('--requests', type=int, default=200, help='requests per route')
+    parser.add_argument('--warmup', type=int, default=10, help='unmeasured requests per route')
+    parser.add_argument('--concurrency', type=int, default=1, help='requests in flight at once')
+    parser.add_argument('--routes', help='only paths containing this text')
+    parser.add_argument('--user', default='user1@example.com', help='HTTP Basic user (a db_seed.py user)')
+    parser.add_argument('--password', default=PASSWORD)
+    parser.add_argument('--save', help='write the results to this JSON file')
+    parser.add_argument('--baseline', help='compare with results saved by --save, exit 1 on regressions')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed slowdown against the baseline')
+    args = parser.parse_args()
+
+    headers = auth_header(args.user, args.password)
+    if args.url:
+        client, counter = HTTPClient(args.url, headers), None
+    else:
+        client = TestClient(headers)
+        counter = QueryCounter([engine for engine in (db.engine, db.replica) if engine is not None])
+
+    results = {}
+    print('%-50s %9s %8s %8s %8s %7s %9s %7s' % ('route', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'queries',
+                                                  'bytes', 'errors'))
+    for path in targets(args.routes):
+        for i in range(args.warmup):
+            client.get(path)
+        result = run(client, path, args.requests, args.concurrency, counter)
+        results[path] = result
+        print('%-50s %9.1f %8.2f %8.2f %8.2f %7s %9d %7d' % (
+            path, result['rps'], result['p50'], result['p95'], result['p99'],
+            '-' if result['queries'] is None else '%.1f' % result['queries'], result['bytes'], result['errors']))
+
+    rss = peak_rss(args.pid) if args.pid or not args.url else None
+    if rss is not None:
+        print('peak RSS: %.1f MB' % rss)
+
+    if args.save:
+        with open(args.save, 'w') as out:
+            json.dump({'mode': 'http' if args.url else 'test_client', 'concurrency': args.concurrency,
+                       'peak_rss': rss, 'routes': results}, out, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as source:
+            baseline = json.load(source)
+        found = []
+        for path, result in sorted(results.items()):
+            if path in baseline['routes']:
+                found.extend(regressions(path, result, baseline['routes'][path], args.tolerance))
+        if rss is not None and baseline.get('peak_rss') and rss > baseline['peak_rss'] * (1 + args.tolerance):
+            found.append('peak RSS %.1f MB -> %.1f MB' % (baseline['peak_rss'], rss))
+        for line in found:
+            print('REGRESSION %s' % line)
+        if found:
+            sys.exit(1)
+        print('no regressions against %s' % args.baseline)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,14 @@
+import sys
+
+from app.server import db
+from app.transfer import export_lines
+
+# Writes contacts, projects, tags, milestones, efforts, columns and issues as
+# NDJSON to the given file, or stdout:
+#   python3 db_export.py backup.ndjson
+
+out = open(sys.argv[1], 'w') if len(sys.argv) > 1 else sys.stdout
+with db.engine.connect() as connection:
+    for chunk in export_lines(connection):
+        out.write(chunk)
+out.close()
@@ -0,0 +1,20 @@
+import sys
+
+from sqlalchemy.exc import IntegrityError
+
+from app.server import db
+from app.transfer import TransferError, import_lines
+
+# Loads a db_export.py file (or stdin) into the database, keeping ids and
+# foreign keys. Runs in one transaction, so a failed import leaves no rows:
+#   python3 db_import.py backup.ndjson
+
+source = open(sys.argv[1]) if len(sys.argv) > 1 else sys.stdin
+try:
+    counts = import_lines(db.session, source)
+    db.session.commit()
+except (TransferError, IntegrityError) as e:
+    db.session.rollback()
+    sys.exit('import failed: %s' % e)
+for kind in sorted(counts):
+    print('%s: %d' % (kind, counts[kind]))
@@ -0,0 +1,40 @@
+from sqlalchemy import inspect
+from sqlalchemy.schema import CreateColumn
+
+from app.server import db
+from app.models import Issue, POSITION_GAP
+from app.sync import SYNC_MODELS
+
+# Brings an existing app.sqlite up to date with app/models.py: creates new
+# tables, adds missing columns and builds missing indexes. Safe to re-run.
+
+db.create_all()
+
+engine = db.engine
+preparer = engine.dialect.identifier_preparer
+inspector = inspect(engine)
+
+for table in db.metadata.sorted_tables:
+    existing_columns = set(column['name'] for column in inspector.get_columns(table.name))
+    for column in table.columns:
+        if column.name not in existing_columns:
+            print('adding column %s.%s' % (table.name, column.name))
+            engine.execute('ALTER TABLE %s ADD COLUMN %s' % (
+                preparer.format_table(table), CreateColumn(column).compile(dialect=engine.dialect)))
+
+    existing_indexes = set(index['name'] for index in inspector.get_indexes(table.name))
+    for index in table.indexes:
+        if index.name not in existing_indexes:
+            print('creating index %s' % index.name)
+            index.create(engine)
+
+# rows from before updated_at count as last changed when they were created
+for model in SYNC_MODELS:
+    table = model.__table__
+    created = table.c.created_at if 'created_at' in table.c else db.func.now()
+    engine.execute(table.update().where(table.c.updated_at == None).values(updated_at=created))
+
+# issues from before card positions keep their id order within a column
+issue = Issue.__table__
+engine.execute(issue.update().where(issue.c.position == None).values(
+    position=issue.c.id * POSITION_GAP, updated_at=issue.c.updated_at))
@@ -0,0 +1,8 @@
+from app.server import db
+from app.search import rebuild_search_index
+
+# Recreates the FTS5 search tables and triggers if missing and reindexes
+# every row from the issue, post, to_do and contact tables.
+
+with db.engine.begin() as connection:
+    rebuild_search_index(connection)
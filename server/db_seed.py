@@ -0,0 +1,34 @@
+import argparse
+import sys
+import time
+
+from app.server import db
+from app.models import Issue
+from app.seed import SCALES, parse_scale, seed
+
+# Fills the database with a generated workspace for benchmark.py. The scale
+# is the number of issues (1k, 100k, 1m or any count); users, contacts,
+# projects, milestones and posts grow with it:
+#   python3 db_seed.py 100k
+#   python3 db_seed.py 1m --seed 7 --reset
+# Point TAGMATIC_DATABASE_URL at a scratch database first; --reset drops
+# every table.
+
+parser = argparse.ArgumentParser(description='Seed the database with generated data.')
+parser.add_argument('scale', type=parse_scale, help='number of issues: %s or a count' % ', '.join(sorted(SCALES)))
+parser.add_argument('--seed', type=int, default=1, help='random seed, the same seed gives the same rows')
+parser.add_argument('--reset', action='store_true', help='drop and recreate every table first')
+args = parser.parse_args()
+
+if args.reset:
+    db.drop_all()
+db.create_all()
+if Issue.query.first() is not None:
+    sys.exit('the database already has issues; seed a new one or pass --reset')
+
+started = time.time()
+counts = seed(db.session, args.scale, args.seed)
+db.session.commit()
+for kind in sorted(counts):
+    print('%s: %d' % (kind, counts[kind]))
+print('seeded in %.1fs' % (time.time() - started))
@@ -0,0 +1,11 @@
+from app.server import db
+from app.stats import counters_enabled, rebuild_counters, drop_counters
+
+# Recounts issue_count for /api/v1/projects/<id>/stats and installs its
+# triggers, or drops the triggers when ISSUE_COUNTERS is off.
+
+with db.engine.begin() as connection:
+    if counters_enabled(connection):
+        rebuild_counters(connection)
+    else:
+        drop_counters(connection)
@@ -0,0 +1,8 @@
+from app.server import app, db
+from app.sync import purge_tombstones
+
+# Drops delete tombstones older than TOMBSTONE_RETENTION days. Clients whose
+# ?since= token is older than that get a 410 and refetch the full list.
+
+with db.engine.begin() as connection:
+    print('purged %d tombstones' % purge_tombstones(connection, app.config['TOMBSTONE_RETENTION']))
@@ -1,4 +1,20 @@
 #!flask/bin/python
-from app.server import app
- 
-app.run("localhost", 5005)
+import os
+
+# TAGMATIC_GEVENT=1 serves every connection from a greenlet, so the open
+# /events streams of idle boards don't each hold a thread
+use_gevent = bool(os.environ.get('TAGMATIC_GEVENT'))
+if use_gevent:
+    from gevent import monkey
+    monkey.patch_all()
+
+from app.factory import create_app
+
+# the development server; serve.py is the production one
+app = create_app()
+
+if use_gevent:
+    from gevent.pywsgi import WSGIServer
+    WSGIServer(("localhost", 5005), app).serve_forever()
+else:
+    app.run("localhost", 5005, threaded=True)
@@ -0,0 +1,89 @@
+import argparse
+import os
+import sys
+
+from gunicorn.app.base import BaseApplication
+
+from app.factory import load_config, create_app, dispose_engines
+
+# The production server: gunicorn with SERVER_WORKERS processes of
+# SERVER_THREADS threads each (app/config.py), the production profile by
+# default. With SERVER_PRELOAD the app is built once and the workers are
+# forked from it; database connections are only opened in the workers.
+#   TAGMATIC_SECRET_KEY=... python3 serve.py --pidfile /run/tagmatic.pid
+# kill -HUP <pid> replaces the workers one by one after their requests
+# finish, with new code unless the app is preloaded; to deploy new code with
+# SERVER_PRELOAD, kill -USR2 <pid> starts a new server next to the old one,
+# then kill -QUIT <old pid> stops the old one gracefully.
+# TAGMATIC_GEVENT=1 runs gevent workers instead of threads (no preload).
+# Every open event stream holds a thread of a threaded worker, so those take
+# at most half their threads' worth of streams (EVENT_MAX_STREAMS) and a sync
+# worker none; run gevent workers to serve many streams.
+
+use_gevent = bool(os.environ.get('TAGMATIC_GEVENT'))
+
+
+class Server(BaseApplication):
+    def __init__(self, app_config, options):
+        self.app_config = app_config
+        self.options = options
+        BaseApplication.__init__(self)
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        return create_app(self.app_config)
+
+
+def clear_metrics(config):
+    # snapshots of the previous server's workers would keep counting
+    def on_starting(server):
+        if config['METRICS'] != 'file' or not os.path.isdir(config['METRICS_PATH']):
+            return
+        for entry in os.listdir(config['METRICS_PATH']):
+            if entry.endswith('.json'):
+                os.remove(os.path.join(config['METRICS_PATH'], entry))
+    return on_starting
+
+
+def pre_fork(server, worker):
+    if 'app.server' in sys.modules:
+        dispose_engines()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the API on gunicorn.')
+    parser.add_argument('--profile', default='production', help='config profile: development or production')
+    parser.add_argument('--bind', help='host:port, SERVER_BIND by default')
+    parser.add_argument('--workers', type=int, help='worker processes, SERVER_WORKERS by default')
+    parser.add_argument('--threads', type=int, help='threads per worker, SERVER_THREADS by default')
+    parser.add_argument('--keepalive', type=int, help='seconds to hold an idle connection, SERVER_KEEPALIVE by default')
+    parser.add_argument('--pidfile', help='write the server process id here')
+    args = parser.parse_args()
+
+    config = load_config(args.profile)
+    if not config['DEBUG'] and config['SECRET_KEY'] == 'development-secret-key':
+        sys.exit('set TAGMATIC_SECRET_KEY, tokens signed with the development key can be forged')
+    threads = args.threads or config['SERVER_THREADS']
+    max_streams = config['EVENT_MAX_STREAMS'] if use_gevent else min(config['EVENT_MAX_STREAMS'], threads // 2)
+    options = {
+        'bind': args.bind or config['SERVER_BIND'],
+        'workers': args.workers or config['SERVER_WORKERS'],
+        'threads': threads,
+        'worker_class': 'gevent' if use_gevent else 'gthread' if threads > 1 else 'sync',
+        'keepalive': args.keepalive or config['SERVER_KEEPALIVE'],
+        'timeout': config['SERVER_TIMEOUT'],
+        'graceful_timeout': config['SERVER_GRACEFUL_TIMEOUT'],
+        # gevent has to patch the worker before the app is imported
+        'preload_app': config['SERVER_PRELOAD'] and not use_gevent,
+        'pidfile': args.pidfile,
+        'on_starting': clear_metrics(config),
+        'pre_fork': pre_fork,
+    }
+    Server({'PROFILE': args.profile, 'EVENT_MAX_STREAMS': max_streams}, options).run()
+
+
+if __name__ == '__main__':
+    main()